@@ -11,11 +11,12 @@
 #
 ################################################################################
 
+import os
 import sys
+import re
 import struct
-from PIL import Image
+from concurrent.futures import ProcessPoolExecutor
 from getopt import getopt, GetoptError
-from copy import copy
 
 # stats kept for verbose (-v) mode
 # i use this for debugging
@@ -65,8 +66,7 @@ def load_hunk(infile, verbose=False):
         window_start = len(hunk) - rewind_distance
 
         if window_start < 0:
-            print("ERROR: file attempt to replay starting %d bytes before end of hunk, but hunk is only %d bytes!" % (rewind_distance, len(hunk)), file = sys.stderr)
-            exit(1)
+            raise ValueError("file attempt to replay starting %d bytes before end of hunk, but hunk is only %d bytes!" % (rewind_distance, len(hunk)))
 
         bytes_read += 2
         window_byte_count, vll_len = load_vll(infile, ctrl_byte & 0xf)
@@ -76,8 +76,7 @@ def load_hunk(infile, verbose=False):
         len_expect += window_byte_count
 
         if window_start >= len(hunk):
-            print("ERROR: file references %d byte replay starting from index of %d but hunk only contains %d bytes!" % (window_byte_count, index, len(hunk)), file = sys.stderr)
-            exit(1)
+            raise ValueError("file references %d byte replay starting from index of %d but hunk only contains %d bytes!" % (window_byte_count, window_start, len(hunk)))
 
         for index in range(window_byte_count):
             hunk.append(hunk[window_start + index])
@@ -108,25 +107,256 @@ def load_img(infile, compressed_len, verbose=False):
 
     return img_dat
 
-class subhunk:
-    def __init__(self):
-        self.literal = [ ]
-        self.rewind = 0
-        self.replay_len = 0
+# upper bounds of the rewind distance buckets reported by img_stats
+REWIND_BUCKETS = (4, 16, 64, 256, 1024, 4096, 16384, 65535)
+
+def parse_vll(dat, pos, first_nibble):
+    """
+    same as load_vll, but reads out of the bytes-like object dat starting at
+    pos.  Returns (value, new pos).
+    """
+    vll = first_nibble
+    if first_nibble == 0xf:
+        latest_byte = 0xff
+        while latest_byte == 0xff:
+            latest_byte = dat[pos]
+            pos += 1
+            vll += latest_byte
+    return (vll, pos)
+
+def img_stats(dat):
+    """
+    walk the hunks of the compressed image dat without decoding anything and
+    count up how it was compressed.  Returns a dict of:
+        hunks           number of hunks
+        literal_bytes   bytes stored as literals
+        match_bytes     bytes produced by replays
+        replays         number of replays
+        rewind_hist     list of how many replays had a rewind distance no
+                        greater than each of REWIND_BUCKETS (and greater than
+                        the previous one)
+    """
+    stats = { 'hunks' : 0, 'literal_bytes' : 0, 'match_bytes' : 0,
+              'replays' : 0, 'rewind_hist' : [0] * len(REWIND_BUCKETS) }
+    pos = 0
+    while pos < len(dat):
+        hunk_len = struct.unpack_from("<I", dat, pos)[0]
+        pos += 4
+        hunk_end = pos + hunk_len
+        stats['hunks'] += 1
+
+        while pos < hunk_end:
+            ctrl_byte = dat[pos]
+            pos += 1
+            literal_byte_count, pos = parse_vll(dat, pos, ctrl_byte >> 4)
+            pos += literal_byte_count
+            stats['literal_bytes'] += literal_byte_count
+
+            if pos >= hunk_end:
+                break
+
+            rewind_distance = struct.unpack_from("<H", dat, pos)[0]
+            pos += 2
+            window_byte_count, pos = parse_vll(dat, pos, ctrl_byte & 0xf)
+            stats['match_bytes'] += window_byte_count + 4
+            stats['replays'] += 1
+
+            for bucket, upper in enumerate(REWIND_BUCKETS):
+                if rewind_distance <= upper:
+                    stats['rewind_hist'][bucket] += 1
+                    break
+    return stats
+
+def hunk_decoded_len(dat, pos, hunk_end):
+    """
+    returns how many bytes the hunk in dat[pos:hunk_end] decodes to, by adding
+    up the lengths in its control bytes without decoding anything
+    """
+    out_len = 0
+    while pos < hunk_end:
+        ctrl_byte = dat[pos]
+        pos += 1
+        literal_byte_count, pos = parse_vll(dat, pos, ctrl_byte >> 4)
+        pos += literal_byte_count
+        out_len += literal_byte_count
+        if pos >= hunk_end:
+            break
+        window_byte_count, pos = parse_vll(dat, pos + 2, ctrl_byte & 0xf)
+        out_len += window_byte_count + 4
+    return out_len
+
+def decode_hunk(dat, pos, hunk_end, limit=None):
+    """
+    decode the hunk in dat[pos:hunk_end].  If limit is given this stops as
+    soon as at least limit bytes have come out.  Raises ValueError on a bad
+    rewind, same as load_hunk.
+    """
+    hunk = bytearray()
+    while pos < hunk_end:
+        if limit is not None and len(hunk) >= limit:
+            break
+        ctrl_byte = dat[pos]
+        pos += 1
+        literal_byte_count, pos = parse_vll(dat, pos, ctrl_byte >> 4)
+        hunk += dat[pos:pos + literal_byte_count]
+        pos += literal_byte_count
+        if pos >= hunk_end:
+            break
+
+        rewind_distance = struct.unpack_from("<H", dat, pos)[0]
+        window_byte_count, pos = parse_vll(dat, pos + 2, ctrl_byte & 0xf)
+        window_byte_count += 4
+        window_start = len(hunk) - rewind_distance
+        if window_start < 0 or rewind_distance == 0:
+            raise ValueError("replay starting %d bytes before the end of a %d byte hunk" % (rewind_distance, len(hunk)))
+        if rewind_distance >= window_byte_count:
+            hunk += hunk[window_start:window_start + window_byte_count]
+        else:
+            # the replay overlaps itself
+            for index in range(window_byte_count):
+                hunk.append(hunk[window_start + index])
+    return hunk
+
+def load_img_range(dat, start, stop=None):
+    """
+    decode only bytes start through stop (exclusive) of the compressed image
+    dat, or start through the end if stop is None.  A replay never reaches
+    back into an earlier hunk, so hunks which end before start are skipped
+    over by their length prefixes (and their control bytes, since the prefix
+    only says how long the hunk is compressed) and nothing after stop is
+    decoded at all.
+    """
+    out = bytearray()
+    out_pos = 0
+    pos = 0
+    while pos < len(dat):
+        if stop is not None and out_pos >= stop:
+            break
+        hunk_len = struct.unpack_from("<I", dat, pos)[0]
+        pos += 4
+        hunk_end = pos + hunk_len
+        if start > out_pos:
+            hunk_out_len = hunk_decoded_len(dat, pos, hunk_end)
+            if out_pos + hunk_out_len <= start:
+                out_pos += hunk_out_len
+                pos = hunk_end
+                continue
+
+        limit = None
+        if stop is not None:
+            limit = stop - out_pos
+        hunk = decode_hunk(dat, pos, hunk_end, limit)
+        out += hunk[max(start - out_pos, 0):limit]
+        out_pos += len(hunk)
+        pos = hunk_end
+    return bytes(out)
+
+def check_img(dat, expect_len):
+    """
+    walk the hunks of the compressed image dat making the same checks as
+    load_hunk, but without decoding anything.  Also checks that every VLL
+    and literal ends before the data does and that the image decodes to
+    expect_len bytes.  Returns a list of everything that's wrong with it
+    (which is empty if nothing is).
+    """
+    errors = []
+    pos = 0
+    decoded_len = 0
+    hunk_no = 0
+    while pos < len(dat):
+        if pos + 4 > len(dat):
+            errors.append("hunk %d: length is cut off at offset %d" % \
+                          (hunk_no, pos))
+            return errors
+        hunk_len = struct.unpack_from("<I", dat, pos)[0]
+        pos += 4
+        hunk_end = pos + hunk_len
+        if hunk_end > len(dat):
+            errors.append("hunk %d: %d bytes long but only %d bytes are left" % \
+                          (hunk_no, hunk_len, len(dat) - pos))
+            return errors
+        hunk_out_len = 0
+
+        while pos < hunk_end:
+            ctrl_byte = dat[pos]
+            pos += 1
+            try:
+                literal_byte_count, pos = parse_vll(dat, pos, ctrl_byte >> 4)
+            except IndexError:
+                errors.append("hunk %d: literal length never ends" % hunk_no)
+                return errors
+            pos += literal_byte_count
+            hunk_out_len += literal_byte_count
+            if pos > hunk_end:
+                errors.append("hunk %d: %d byte literal runs %d bytes past the end of the hunk" % \
+                              (hunk_no, literal_byte_count, pos - hunk_end))
+                return errors
+
+            if pos >= hunk_end:
+                break
+
+            if pos + 2 > hunk_end:
+                errors.append("hunk %d: rewind distance is cut off at offset %d" % \
+                              (hunk_no, pos))
+                return errors
+            rewind_distance = struct.unpack_from("<H", dat, pos)[0]
+            pos += 2
+            try:
+                window_byte_count, pos = parse_vll(dat, pos, ctrl_byte & 0xf)
+            except IndexError:
+                errors.append("hunk %d: replay length never ends" % hunk_no)
+                return errors
+            if pos > hunk_end:
+                errors.append("hunk %d: replay length never ends before the end of the hunk" % \
+                              hunk_no)
+                return errors
+            window_byte_count += 4
+
+            if rewind_distance > hunk_out_len:
+                errors.append("hunk %d: replay starts %d bytes before the end of the hunk but the hunk is only %d bytes" % \
+                              (hunk_no, rewind_distance, hunk_out_len))
+            elif rewind_distance == 0:
+                errors.append("hunk %d: replay has a rewind distance of 0" % \
+                              hunk_no)
+            hunk_out_len += window_byte_count
+
+        decoded_len += hunk_out_len
+        hunk_no += 1
+
+    if decoded_len != expect_len:
+        errors.append("decodes to %d bytes but should be %d" % \
+                      (decoded_len, expect_len))
+    return errors
+
+# most bytes one hunk can decode to
+HUNK_LEN = 65536
+
+def match_len(dat, pos, src, end):
+    """
+    returns how many bytes starting at pos in dat are the same as the ones
+    starting at src, without going past end.  src can overlap pos, the same
+    as a replay can.  The bytes are compared a growing chunk at a time as big
+    integers so that the first difference is found without looping over them
+    in python.
+    """
+    n = 0
+    step = 16
+    while pos + n < end:
+        if step > end - pos - n:
+            step = end - pos - n
+        diff = int.from_bytes(dat[pos + n:pos + n + step], "big") ^ \
+               int.from_bytes(dat[src + n:src + n + step], "big")
+        if diff:
+            return n + step - (diff.bit_length() + 7) // 8
+        n += step
+        step *= 2
+    return n
 
 class compressor:
-    def __init__(self, verbose = False):
-        self.window = bytearray()
-        self.state = "LITERAL"
-        self.cur_match = bytearray()
-        self.cur_match_start = -1
-        self.window_end = 0
-        self.literal = bytearray()
-        self.uncompressed_len = 0
+    def __init__(self, verbose = False, quiet = False):
+        self.rawdat = bytearray()
         self.verbose = verbose
-
-        self.hunks = []
-        self.sub = []
+        self.quiet = quiet
 
     @staticmethod
     def encode_vll(val):
@@ -151,163 +381,271 @@ class compressor:
         return bts
 
     def push_byte(self, cur_byte):
-        self.uncompressed_len += 1
-        if len(self.window) >= 65536:
-            if len(self.cur_match) < 4:
-                self.sub.append(subhunk())
-                self.sub[-1].literal = bytearray(self.cur_match)
-            else:
-                self.sub.append(subhunk())
-                self.sub[-1].literal = self.literal
-                self.sub[-1].rewind = self.window_end - self.cur_match_start
-                self.sub[-1].replay_len = len(self.cur_match)
-                if self.sub[-1].replay_len < 4:
-                    print("WHAT THE FUCK replay_len IS %d" % 4,file = sys.stderr)
+        self.rawdat.append(cur_byte)
+
+    def push_bytes(self, bts):
+        self.rawdat.extend(bts)
 
+    def add_subhunk(self, hunkdat, literal, rewind=0, replay_len=0):
+        """
+        append a control byte, literal and replay to hunkdat.  Only the last
+        subhunk of a hunk can leave the replay out (replay_len 0).
+        """
+        litlen = compressor.encode_vll(len(literal))
+        if replay_len:
+            replen = compressor.encode_vll(replay_len - 4)
+        else:
+            replen = bytearray(1)
+        hunkdat.append((litlen[0] << 4) | replen[0])
+        hunkdat += litlen[1:]
+        hunkdat += literal
+        if replay_len:
+            hunkdat += struct.pack("<H", rewind)
+            hunkdat += replen[1:]
             if self.verbose:
-                print("SPLIT OFF NEW HUNK, OLD HUNK LENGTH IS %d" % len(self.window))
-            self.hunks.append((len(self.window), self.sub))
-            self.window = bytearray()
-            self.state = "LITERAL"
-            self.cur_match = bytearray()
-            self.cur_match_start = -1
-            self.window_end = 0
-            self.literal = bytearray()
-            self.uncompressed_len = 0
-            self.sub = []
-
-        while True:
-            if self.state == "REWIND":
-                next_match = copy(self.cur_match)
-                next_match.append(cur_byte)
-
-                if self.cur_match_start >= 0 and self.cur_match_start + len(next_match) <= len(self.window) and self.window[self.cur_match_start + len(next_match) - 1] == cur_byte:
-                    subseq_start = self.cur_match_start
-                else:
-                    subseq_start = self.window.rfind(next_match)
-                if subseq_start >= 0:
-                    # add cur_byte to self.cur_match and self.window
-                    self.cur_match = next_match
-                    self.cur_match_start = subseq_start
-                    self.window.append(cur_byte)
-                    return
-                else:
-                    if len(self.cur_match) < 4:
-                        # the compression format used by chowdren does not
-                        # allow for replays of less than four bytes, so add this
-                        # to the literal instead.
-                        self.literal += self.cur_match
-                        self.cur_match = bytearray()
-                        self.state = "LITERAL"
-                        continue
-
-                    self.sub.append(subhunk())
-
-                    # save offset to replay data (from end of window)
-                    # TODO: make sure it doesn't overflow a 16-bit int here
-                    #print("self.window_end is %d, self.cur_match_start is %d" % (self.window_end,self.cur_match_start))
-                    self.sub[-1].literal = self.literal
-                    self.sub[-1].rewind = self.window_end - self.cur_match_start
-                    self.sub[-1].replay_len = len(self.cur_match)
-                    if self.sub[-1].replay_len < 4:
-                        print("WHAT THE FUCK replay_len IS %d" % 4,file = sys.stderr)
-
-                    if self.verbose:
-                        if len(self.cur_match):
-                            print("%d literal bytes, %d repeat bytes starting %d from the end (index %d)" % \
-                                  (len(self.literal), len(self.cur_match), self.window_end - self.cur_match_start, self.cur_match_start))
-                        else:
-                            print("%d literal bytes, %d repeat bytes starting XXX from the end" % (len(self.literal), len(self.cur_match)))
-
-                    # reset state machine
-                    self.state = "LITERAL"
-                    self.literal = bytearray()
-                    self.cur_match = bytearray()
+                print("%d literal bytes, %d repeat bytes starting %d from the end" % \
+                      (len(literal), replay_len, rewind))
+
+    def compress_hunk(self, dat, start, end):
+        """
+        compress dat[start:end] as one hunk, without its length.  Each
+        position gets the longest match there is for it anywhere earlier in
+        the hunk, or becomes part of a literal if that's under 4 bytes.
+
+        first_seen says where each sequence of 4 bytes first comes up in the
+        hunk.  A match can only get one byte longer if its last 4 bytes came
+        up somewhere before, so most searches of the window for a longer one
+        are ruled out with one lookup.
+        """
+        hunkdat = bytearray()
+        first_seen = {}
+        for key_pos in range(end - 4, start - 1, -1):
+            first_seen[dat[key_pos:key_pos + 4]] = key_pos
+
+        literal_start = start
+        pos = start
+        while pos < end:
+            best_len = 0
+            best_dist = 0
+            if pos + 4 <= end:
+                src = first_seen[dat[pos:pos + 4]]
+                if src < pos:
+                    best_len = 4 + match_len(dat, pos + 4, src + 4, end)
+                    best_dist = pos - src
+
+                    # now look for anything longer than that
+                    length = best_len + 1
+                    while pos + length <= end and \
+                          first_seen[dat[pos + length - 4:pos + length]] < \
+                          pos + length - 4:
+                        src = dat.rfind(dat[pos:pos + length], start, \
+                                        pos + length - 1)
+                        if src < 0:
+                            break
+                        best_len = length + match_len(dat, pos + length, \
+                                                      src + length, end)
+                        best_dist = pos - src
+                        length = best_len + 1
+
+            if best_len >= 4:
+                self.add_subhunk(hunkdat, dat[literal_start:pos], best_dist, \
+                                 best_len)
+                pos += best_len
+                literal_start = pos
             else:
-                if cur_byte in self.window:
-                    self.state = "REWIND"
-                    self.window_end = len(self.window) # + len(self.literal)
-                else:
-                    self.literal.append(cur_byte)
-                    self.window.append(cur_byte)
-                    return
+                pos += 1
+        if literal_start < end:
+            self.add_subhunk(hunkdat, dat[literal_start:end])
+        return hunkdat
 
     def get_raw_data(self):
-        if len(self.literal) or len(self.cur_match):
+        dat = bytes(self.rawdat)
+        data = bytearray()
+        for start in range(0, len(dat), HUNK_LEN):
+            hunkdat = self.compress_hunk(dat, start, \
+                                         min(start + HUNK_LEN, len(dat)))
             if self.verbose:
-                print("adding residual data to the end of the final hunk")
-                print("residual data contains %d literal and %d repeat" % (len(self.literal), len(self.cur_match)))
-            # need to add residual unsaved data to end of hunk
-            if len(self.cur_match) and len(self.cur_match) < 4:
-                self.sub.append(subhunk())
-                self.sub[-1].literal = self.literal + self.cur_match
-            else:
-                self.sub.append(subhunk())
-                self.sub[-1].literal = self.literal
-                self.sub[-1].rewind = self.window_end - self.cur_match_start
-                self.sub[-1].replay_len = len(self.cur_match)
-                if self.sub[-1].replay_len < 4:
-                    print("WHAT THE FUCK replay_len IS %d" % 4,file = sys.stderr)
-            self.literal = bytearray()
-            self.cur_match = bytearray()
-
-        if len(self.sub):
-            # need to complete residual hunk
-            self.hunks.append((len(self.window), self.sub))
-            self.window = bytearray()
-            self.sub = []
-
-        data = bytes()
-        # compile the hunks into raw binary data
-        for hk in self.hunks:
-            hunkdat = bytes()
-            for sh in hk[1]:
-                no_replay = False
-                if sh.replay_len < 4:
-                    # TODO: maybe check to make sure this only happens when the entire hunk is
-                    #       a single subhunk's literal section
-                    # print("ERROR: replay_len is %d" % sh.replay_len, file=sys.stderr)
-                    # print("original uncompressed length was %d bytes" % self.uncompressed_len, file=sys.stderr)
-                    # exit(1)
-                    sh.replay_len = 4# replay length will be ignored if the literal section contains the entire hunk
-                    no_replay = True
-
-                litlen = compressor.encode_vll(len(sh.literal))
-                replen = compressor.encode_vll(sh.replay_len - 4)
-                control_byte = (litlen[0] << 4) | replen[0]
-
-                hunkdat += struct.pack("B", control_byte) + litlen[1:] + sh.literal
-
-                if not no_replay:
-                    hunkdat += struct.pack("<H", sh.rewind) + replen[1:]
-            hunklen = len(hunkdat)
-            data += struct.pack("<I", hunklen) + hunkdat
+                print("hunk starting at %d compressed to %d bytes" % \
+                      (start, len(hunkdat)))
+            data += struct.pack("<I", len(hunkdat)) + hunkdat
 
+        if self.quiet:
+            return bytes(data)
         compressed_len = len(data)
-        print("original uncompressed length was %d bytes" % self.uncompressed_len)
+        print("original uncompressed length was %d bytes" % len(dat))
         print("compressed length is %d bytes" % compressed_len)
-        print("compression ratio is %f%%" % (100 * compressed_len / self.uncompressed_len))
-        return data
+        if len(dat):
+            print("compression ratio is %f%%" % (100 * compressed_len / len(dat)))
+        return bytes(data)
 
     def save(self, stream):
         # write data to file
         stream.write(self.get_raw_data())
 
-def compress_img(rawdat, verbose=False):
-    print("****** BEGIN NEW IMAGE COMPRESSION ******")
-    comp = compressor(verbose=verbose)
-    for bt in rawdat:
-        comp.push_byte(bt)
+def compress_img(rawdat, verbose=False, quiet=False):
+    """
+    compress the RGBA data rawdat.  If quiet is True nothing is printed.
+    """
+    if not quiet:
+        print("****** BEGIN NEW IMAGE COMPRESSION ******")
+    comp = compressor(verbose=verbose, quiet=quiet)
+    comp.push_bytes(rawdat)
     return comp.get_raw_data()
 
+def convert_file(src_file, dst_file, width=-1, height=-1, verbose=False, \
+                 quiet=False):
+    """
+    convert src_file to dst_file based on their extensions (see the usage
+    string below).  width and height are only needed when the destination is
+    a png and the source isn't.  quiet is passed on to compress_img.  Raises
+    ValueError if the conversion can't be done.
+    """
+    from PIL import Image
+
+    src_ext = src_file.rpartition('.')[2].casefold()
+    dst_ext = dst_file.rpartition('.')[2].casefold()
+
+    if src_ext == 'png':
+        img_obj = Image.open(src_file)
+        if width < 0:
+            width = img_obj.width
+        if height < 0:
+            height = img_obj.height
+        img_dat = img_obj.tobytes()
+    elif src_ext == 'bin':
+        with open(src_file, "rb") as infile:
+            infile.seek(0, 2)
+            compressed_len = infile.tell()
+            infile.seek(0)
+            img_dat = load_img(infile, compressed_len, verbose)
+    elif src_ext == 'raw':
+        with open(src_file, "rb") as infile:
+            img_dat = infile.read()
+    else:
+        raise ValueError("unrecognized source file extension \"%s\"" % src_ext)
+
+    if dst_ext == 'png':
+        if width < 0 or height < 0:
+            raise ValueError("destination file type \"png\" required width (-w option) and height (-h option)")
+        if len(img_dat) != width * height * 4:
+            print("WARNING: expected decompressed image size is %d but in reality it's %d" % (width * height * 4, len(img_dat)), file=sys.stderr)
+        img_obj = Image.frombytes("RGBA", (width, height), bytes(img_dat))
+        img_obj.save(dst_file)
+    elif dst_ext == 'bin':
+        with open(dst_file, "wb") as outfile:
+            outfile.write(compress_img(img_dat, verbose=verbose, quiet=quiet))
+    elif dst_ext == 'raw':
+        with open(dst_file, "wb") as outfile:
+            outfile.write(bytes(img_dat))
+    else:
+        raise ValueError("unrecognized destination file extension \"%s\"" % dst_ext)
+
+def meta_dimensions(src_file):
+    """
+    fp-assets.py -r saves the resolution of each raw image as "WxH" on the last
+    line of the _meta.txt next to it.  Returns (width, height) from that file
+    for src_file, or (-1, -1) if there isn't one.  Raises ValueError if the
+    resolution line isn't WxH.
+    """
+    meta_path = src_file.rpartition('.')[0] + "_meta.txt"
+    try:
+        with open(meta_path, "r") as meta_file:
+            lines = meta_file.read().splitlines()
+    except OSError:
+        return (-1, -1)
+    if len(lines) < 5:
+        return (-1, -1)
+    match = re.match(r"^(\d+)x(\d+)$", lines[4].strip())
+    if match is None:
+        raise ValueError("%s: expected a resolution like \"WxH\" on line 5, not \"%s\"" % \
+                         (meta_path, lines[4]))
+    return (int(match.group(1)), int(match.group(2)))
+
+def read_manifest(manifest_path):
+    """
+    read a batch manifest.  Each line is "src dst [width height]"; blank lines
+    and lines starting with # are skipped.  Returns a list of
+    (src, dst, width, height) jobs.
+    """
+    jobs = []
+    with open(manifest_path, "r") as manifest:
+        for line_no, line in enumerate(manifest.read().splitlines()):
+            fields = line.split()
+            if not fields or fields[0].startswith("#"):
+                continue
+            if len(fields) == 2:
+                jobs.append((fields[0], fields[1], -1, -1))
+            elif len(fields) == 4:
+                jobs.append((fields[0], fields[1], \
+                             int(fields[2]), int(fields[3])))
+            else:
+                raise ValueError("%s line %d: expected \"src dst [width height]\"" % (manifest_path, line_no + 1))
+    return jobs
+
+def dir_jobs(src_dir, dst_dir, dst_ext):
+    """
+    returns a job converting every png, bin and raw file in src_dir to a file
+    with the same name but extension dst_ext in dst_dir
+    """
+    jobs = []
+    for name in sorted(os.listdir(src_dir)):
+        base, dot, ext = name.rpartition('.')
+        if not dot or ext.casefold() not in ('png', 'bin', 'raw'):
+            continue
+        jobs.append((os.path.join(src_dir, name), \
+                     os.path.join(dst_dir, base + "." + dst_ext), -1, -1))
+    return jobs
+
+def convert_job(job, verbose=False):
+    """
+    run one batch job.  Returns None if it worked or the error message if it
+    didn't.
+    """
+    src_file, dst_file, width, height = job
+    try:
+        if (width < 0 or height < 0) and \
+           src_file.rpartition('.')[2].casefold() != 'png':
+            width, height = meta_dimensions(src_file)
+        dst_dir = os.path.dirname(dst_file)
+        if dst_dir:
+            os.makedirs(dst_dir, exist_ok=True)
+        convert_file(src_file, dst_file, width, height, verbose, \
+                     quiet=not verbose)
+    except Exception as err:
+        return "%s: %s" % (type(err).__name__, err)
+    return None
+
+def convert_batch(jobs, n_jobs=None, verbose=False):
+    """
+    run every (src, dst, width, height) job in jobs on a pool of n_jobs worker
+    processes.  A job failing doesn't stop the others; returns a list of
+    (job, error message) for every one that failed.
+    """
+    failures = []
+    with ProcessPoolExecutor(n_jobs) as pool:
+        for job, err in zip(jobs, pool.map(convert_job, jobs, \
+                                           [verbose] * len(jobs))):
+            if err is not None:
+                print("FAILED %s -> %s: %s" % (job[0], job[1], err), \
+                      file=sys.stderr)
+                failures.append((job, err))
+            elif verbose:
+                print("converted %s -> %s" % (job[0], job[1]))
+    return failures
+
 if __name__=='__main__':
     usage_string="""\
     Usage: %s [-v] [-w width -h height] <in-file> <out-file>
+           %s [-v] [-j jobs] -m <manifest>
+           %s [-v] [-j jobs] -t <out-ext> <in-dir> <out-dir>
 
     -v    Verbose-mode
     -h    set height of image (mandatory when using -x)
     -w    set width of image (mandatory when using -x)
     -w    set width
+    -m    convert every "src dst [width height]" pair listed in manifest, one per line
+    -t    convert every png, bin and raw file in in-dir to an out-ext file in out-dir
+    -j    number of worker processes for -m and -t (defaults to the number of CPUs)
 
     chowimg.py converts images between two different image formats.
     It should not be run as an independent program unless you're doing testing.
@@ -326,16 +664,23 @@ if __name__=='__main__':
     be supplied with the -w and -h options.  As an exception, the width and height
     will be determined automatically if the source-file is .png, but then you're converting
     from a .png img to a .png image and that's just stupid.
-    """ % sys.argv[0]
+
+    In batch mode (-m or -t) the width and height of a .bin or .raw file are
+    taken from the _meta.txt file fp-assets.py -r saves next to it unless the
+    manifest gives them.  Files which fail to convert are reported and skipped.
+    """ % (sys.argv[0], sys.argv[0], sys.argv[0])
 
     width = -1
     height = -1
     verbose = False
+    manifest_path = None
+    batch_ext = None
+    n_jobs = None
 
     # TODO: we don't actually need -r, -c and -x
     # we can just decide what to do based on file extensions
     try:
-        opt_val, params = getopt(sys.argv[1:], "w:h:v")
+        opt_val, params = getopt(sys.argv[1:], "w:h:vm:t:j:")
         for option, value in opt_val:
             if option == "-w":
                 width = int(value)
@@ -344,51 +689,47 @@ if __name__=='__main__':
             elif option == "-v":
                 print("verbose mode enabled", file=sys.stderr)
                 verbose = True
-    except GetoptError:
+            elif option == "-m":
+                manifest_path = value
+            elif option == "-t":
+                batch_ext = value
+            elif option == "-j":
+                n_jobs = int(value)
+    except (GetoptError, ValueError):
+        print(usage_string)
+        exit(1)
+
+    if manifest_path is not None or batch_ext is not None:
+        try:
+            if manifest_path is not None:
+                jobs = read_manifest(manifest_path)
+            else:
+                if len(params) != 2:
+                    print(usage_string)
+                    exit(1)
+                os.makedirs(params[1], exist_ok=True)
+                jobs = dir_jobs(params[0], params[1], batch_ext)
+        except (OSError, ValueError) as err:
+            print("ERROR: %s" % err, file=sys.stderr)
+            exit(1)
+
+        failures = convert_batch(jobs, n_jobs, verbose)
+        print("converted %d of %d files" % (len(jobs) - len(failures), len(jobs)))
+        if failures:
+            exit(1)
+        exit(0)
+
+    if len(params) != 2:
         print(usage_string)
         exit(1)
 
     src_file = params[0]
     dst_file = params[1]
     print("request to convert from %s to %s" % (src_file, dst_file))
-    src_ext = src_file.rpartition('.')[2].casefold()
-    dst_ext = dst_file.rpartition('.')[2].casefold()
-    print("source extension is %s" % src_ext)
+    print("source extension is %s" % src_file.rpartition('.')[2].casefold())
 
-    if src_ext == 'png':
-        img_obj = Image.open(src_file)
-        if width < 0:
-            width = img_obj.width
-        if height < 0:
-            height = img_obj.height
-        img_dat = img_obj.tobytes()
-    elif src_ext == 'bin':
-        with open(src_file, "rb") as infile:
-            infile.seek(0, 2)
-            compressed_len = infile.tell()
-            infile.seek(0)
-            img_dat = load_img(infile, compressed_len, verbose)
-    elif src_ext == 'raw':
-        with open(src_file, "rb") as infile:
-            img_dat = infile.read()
-    else:
-        print("ERROR: unrecognized source file extension \"%s\"" % src_ext, file=sys.stderr)
-        exit(1)
-
-    if dst_ext == 'png':
-        if width < 0 or height < 0:
-            print("ERROR: destination file type \"png\" required width (-w option) and height (-h option)", file=sys.stderr)
-            exit(1)
-        if len(img_dat) != width * height * 4:
-            print("WARNING: expected decompressed image size is %d but in reality it's %d" % (width * height * 4, len(img_dat)), file=sys.stderr)
-        img_obj = Image.frombytes("RGBA", (width, height), bytes(img_dat))
-        img_obj.save(dst_file)
-    elif dst_ext == 'bin':
-        with open(dst_file, "wb") as outfile:
-            outfile.write(compress_img(img_dat, verbose=verbose))
-    elif dst_ext == 'raw':
-        with open(dst_file, "wb") as outfile:
-            outfile.write(bytes(img_dat))
-    else:
-        print("ERROR: unrecognized destination file extension \"%s\"" % src_ext, file=sys.stderr)
+    try:
+        convert_file(src_file, dst_file, width, height, verbose)
+    except ValueError as err:
+        print("ERROR: %s" % err, file=sys.stderr)
         exit(1)
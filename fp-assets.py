@@ -11,33 +11,31 @@
 #
 ################################################################################
 
-import re
-import struct
+# this is just the command-line interface, everything else lives in
+# fpassets.py so that it can be imported.
+
 import os
-import zlib
 import sys
-import json
-import hashlib
-from PIL import Image
 from getopt import getopt, GetoptError
-from chowimg import load_img, compress_img
+from fpassets import extract_all_assets, write_assets_file, diff_assets, \
+    apply_patch, scan_assets, load_format, known_format, md5sum
 
 assets_file_path="Assets.dat"
 assets_dir_path="Assets"
 
 verbose = False
 
-img_dir = None
-audio_dir = None
-shader_dir = None
-file_dir = None
-font_dir = None
-
-preload_file_path = None
-type_sizes_path = None
-
 usage_string = """\
-Usage: %s -c | -x [ -f|--file=<in-file> ] [-m metadata_file] [-r] [pathname]
+Usage: %s -c | -x [ -f|--file=<in-file> ] [-m metadata_file] [-r|-a] [--resume] [--cache=<dir>] [--cache-size=<MiB>] [--clear-alpha] [--pipeline [-j jobs] [--decode-jobs=<jobs>] [--write-jobs=<jobs>]] [pathname]
+       %s -c | -x --sqlite [ -f|--file=<in-file> ] [-m metadata_file] [--pixels] [--clear-alpha] [db-file]
+       %s --diff [ -f|--file=<in-file> ] [-m metadata_file] <new-file> <patch>
+       %s --apply [ -f|--file=<in-file> ] <patch> <out-file>
+       %s --serve [ -f|--file=<in-file> ] [-m metadata_file] [--port=<port>] [-j jobs]
+       %s --scan [ -f|--file=<in-file> ] [-m metadata_file] [-v]
+       %s --build-lookup [ -f|--file=<in-file> ] [-m metadata_file] [--dhash] [-j jobs]
+       %s --lookup [ -f|--file=<in-file> ] <png> [<png> ...]
+       %s --daemon=<socket> [-j jobs]
+       %s --analyze [ -f|--file=<in-file> ] [-m metadata_file] [--sort=<field>] [--report=<out-file>] [--recompress] [-j jobs]
 
 in-file is a path to your Assets.dat file.  it defaults to ./Assets.dat
 pathname is the path to the directory to be extracted to/created from.
@@ -47,464 +45,92 @@ pathname is the path to the directory to be extracted to/created from.
 -x extracts Assets.dat
 -m is the path to a json file describing Assets.dat metadata; this is only required if fp-assets.py cannot auto-identify your file
 -r extracts images as raw "binary blobs" instead of decoding them and converting to PNG; only use this if you *absolutely* understand what you're doing.
+-a extracts images into a few large atlas sheets (images/atlas_*.png) described by images/atlas.json instead of one PNG per image, and the glyphs of each font into one glyphs.png described by glyphs.json.  -c builds from the atlases automatically.
+--diff compares new-file against in-file and saves every entry which changed to patch.  -m describes in-file; new-file uses the same metadata unless it is an official release.
+--apply recreates the Assets.dat patch was made from out of in-file and saves it to out-file.
+--serve serves individual assets out of in-file over http on localhost (see fpserve.py); port defaults to 8000.
+--analyze reports how well each image compresses (see fpanalyze.py).  --sort picks the column to sort by (largest first), --report saves every row as csv (or json if out-file ends in .json) and --recompress also estimates how much recompressing each image would save (slow for chowdren images).
+--scan checks that every entry in in-file is well-formed without extracting anything: images have to decode to the right size without any bad replays, and everything else has to fit inside the file.  Every problem is printed and the exit status is 1 if there were any.
+--build-lookup decodes every image in in-file and saves a hash of each one to <in-file>.lookup.json (see fplookup.py).  --dhash also saves a perceptual hash, so that pngs which were edited a little can still be found.
+--lookup prints which image in in-file each png is, using the index saved by --build-lookup.
+--daemon listens on the unix socket socket for requests to extract, compress, patch and verify, keeping archives and worker processes ready between requests (see fpdaemon.py for the protocol).
+-j sets how many worker threads/processes to use; it defaults to the number of CPUs.
 
-extracting will exit with an error if pathname already exists.
-""" % sys.argv[0]
+--sqlite extracts into (or creates from) the SQLite database db-file instead of a directory (see fpstore.py); db-file defaults to ./Assets.sqlite.  Images stay compressed unless --pixels is given, which also saves the decoded RGBA of every image.
 
-def extract_glyph(assets_file, metrics_path, img_path):
-    """
-    reads in a glyph from assets_file and saves the metrics
-    to a json and the glyph itself to a png.
+--cache keeps every image that gets decoded in dir (see fpcache.py), so extracting another version of Assets.dat later only has to decode the images which changed.  --cache-size limits the cache to that many MiB (default 1024); the least recently used images are thrown out first.
 
-    metrics_path is the name of the file that will hold the metrics.
-    img_path is the name of the file that will hold the image.
-    """
-    metrics = { }
-    metrics['charcode'], = struct.unpack("<I", assets_file.read(4))
-    metrics['x1'], = struct.unpack("<f", assets_file.read(4))
-    metrics['y1'], = struct.unpack("<f", assets_file.read(4))
-    metrics['x2'], = struct.unpack("<f", assets_file.read(4))
-    metrics['y2'], = struct.unpack("<f", assets_file.read(4))
-    metrics['advance_x'], = struct.unpack("<f", assets_file.read(4))
-    metrics['advance_y'], = struct.unpack("<f", assets_file.read(4))
-    metrics['corner_x'], = struct.unpack("<f", assets_file.read(4))
-    metrics['corner_y'], = struct.unpack("<f", assets_file.read(4))
-    metrics['width'], = struct.unpack("<I", assets_file.read(4))
-    metrics['height'], = struct.unpack("<I", assets_file.read(4))
-
-    metrics_file = open(metrics_path, "w")
-    metrics_file.write(json.dumps(metrics))
-
-    w = metrics['width']
-    h = metrics['height']
-
-    if w > 0 and h > 0:
-        raw_img = assets_file.read(w * h)
-        out_img = Image.frombytes("L", (w, h), raw_img)
-        out_img.save(img_path)
-
-def extract_font(assets_file, cur_font_dir):
-    """
-    reads a font in from assets_file, saves the metrics to a json,
-    and then calls read_glyph for each glyph in the font.
-    All font-data will be saved under cur_font_dir.
-    assets_file should be seek'd to the beginning of the font data before
-    calling this function.
-    """
-    os.mkdir(cur_font_dir, 0o755)
-
-    font_metrics = {}
-    font_metrics['size'], = struct.unpack("<H", assets_file.read(2))
-    font_metrics['flags'], = struct.unpack("<H", assets_file.read(2))
-    font_metrics['width'],  = struct.unpack("<f", assets_file.read(4))
-    font_metrics['height'], = struct.unpack("<f", assets_file.read(4))
-    font_metrics['ascent'], = struct.unpack("<f", assets_file.read(4))
-    font_metrics['descent'], = struct.unpack("<f", assets_file.read(4))
-    font_metrics['glyph_count'], = struct.unpack("<I", assets_file.read(4))
-
-    metrics_file = open(os.path.join(cur_font_dir, \
-                                     "font_metrics.json"), "w")
-    metrics_file.write(json.dumps(font_metrics))
-    for glyph_no in range(font_metrics['glyph_count']):
-        glyph_metrics_path = os.path.join(cur_font_dir, \
-                                          "glyph_%d_metrics.json" % glyph_no)
-        glyph_img_path = os.path.join(cur_font_dir, "glyph_%d.png" % glyph_no)
-        extract_glyph(assets_file, metrics_path=glyph_metrics_path, \
-                      img_path=glyph_img_path)
-
-# Format of images in Assets.dat:
-#     width (16 bits)
-#     height (16 bits)
-#     The four mystery integers (16 bits * 4)
-#     Compressed file length (32-bits)
-#     32-bit RGBA image data, compressed using either zlib or a custom algorithm (see chowimg.py)
-#
-# These are all little-endian values.
-def extract_img(assets_file, out_img_path, out_meta_path, raw_images):
-    """
-    extract an image from assets_file.  The image will be saved in out_img_path
-    and the metadata (excluding the image resolution) will be saved as text to
-    out_meta_path.  assets_file's stream position should already point to the
-    beginning of the data (image width) before calling this function.
-    """
-    img_w = struct.unpack("<H", assets_file.read(2))[0]
-    img_h = struct.unpack("<H", assets_file.read(2))[0]
-
-    # After the image dimensions there are 4 16-bit integers.
-    # I do not know what these represent, so I save them to a text file
-    # so they'll be around later when we build a new Assets.dat
-    meta_txt = open(os.path.join(img_dir, out_meta_path), "w")
-    for i in range(4):
-        meta_txt.write("0x%x\n" % struct.unpack("<H", assets_file.read(2))[0])
-
-    file_len = struct.unpack("<I", assets_file.read(4))[0]
-
-    if raw_images:
-        meta_txt.write("%ux%u\n" % (img_w,img_h))
-        dat = assets_file.read(file_len)
-        outfile = open(os.path.join(img_dir, out_img_path), "wb")
-        outfile.write(dat)
-        outfile.close()
-    else:
-        if image_format == 'chowdren':
-            file_dat = load_img(assets_file, file_len)
-        elif image_format == 'zlib':
-            file_dat = zlib.decompress(assets_file.read(file_len))
-        else:
-            print("unknown image compression format %s" % image_format)
-            exit(1)
+--clear-alpha makes -c set the color of every fully transparent pixel to black before compressing each image, which doesn't change how anything looks in-game but makes the images compress smaller and faster.  The size and time of each image is printed; with -v each image is also compressed without clearing to show the difference.  With --sqlite only the images that have to be compressed again (the ones whose blob is NULL) are cleared.
 
-        out_img = Image.frombytes("RGBA", (img_w, img_h), bytes(file_dat))
-        out_img.save(os.path.join(img_dir, out_img_path))
+--pipeline makes -x read, decode and save images all at the same time, with --decode-jobs threads decoding and --write-jobs threads saving (chowdren images are decoded in --decode-jobs processes instead, since decoding them doesn't release the GIL).  Both default to -j.
 
-def extract_text(assets_file, out_file_path):
-    """
-    extract a text file from assets_file.
-    out_file_path is the path to where the text should be saved.
-    assets_file should already be seek'd to the 4-byte length that
-    precede's the text.
-    """
-    file_len = struct.unpack("<I", assets_file.read(4))[0]
-    file_dat = assets_file.read(file_len)
-    out_file = open(out_file_path,"wb")
-    out_file.write(file_dat)
+--resume continues an extraction into pathname that was interrupted, skipping everything that was already extracted.
+
+extracting will exit with an error if pathname already exists, unless --resume is given.
+""" % ((sys.argv[0],) * 10)
 
-def init_paths(assets_dir_path):
+def identify_format(assets_file_path, metadata_json):
     """
-    if you're importing fp-assets as a library and you're not calling
-    extract_all_assets, you have to call this function before doing anything
-    else to initialize some global variables.
+    figure out the format metadata for the Assets.dat at assets_file_path.
+    If metadata_json is None this goes by the file's md5sum and exits with an
+    error if it isn't an official release, otherwise metadata_json is loaded.
     """
-    global img_dir, audio_dir, shader_dir, file_dir, \
-        font_dir, preload_file_path, type_sizes_path
-    img_dir = os.path.join(assets_dir_path, "images")
-    audio_dir = os.path.join(assets_dir_path, "audio")
-    shader_dir = os.path.join(assets_dir_path, "shaders")
-    file_dir = os.path.join(assets_dir_path, "files")
-    font_dir = os.path.join(assets_dir_path, "fonts")
-
-    preload_file_path = os.path.join(assets_dir_path, "preload_data.bin")
-    type_sizes_path = os.path.join(assets_dir_path, "type_sizes.txt")
-
-def write_glyph(assets_file, img_path, metrics_path):
-    metrics_file = open(metrics_path, "r")
-
-    metrics_data_map = json.loads(metrics_file.read())
-    metrics_data_bin = struct.pack("<IffffffffII",                       \
-                                   int(metrics_data_map['charcode']),    \
-                                   float(metrics_data_map['x1']),        \
-                                   float(metrics_data_map['y1']),        \
-                                   float(metrics_data_map['x2']),        \
-                                   float(metrics_data_map['y2']),        \
-                                   float(metrics_data_map['advance_x']), \
-                                   float(metrics_data_map['advance_y']), \
-                                   float(metrics_data_map['corner_x']),  \
-                                   float(metrics_data_map['corner_y']),  \
-                                   int(metrics_data_map['width']),       \
-                                   int(metrics_data_map['height']))
-
-    assets_file.write(metrics_data_bin)
-
-    w = metrics_data_map['width']
-    h = metrics_data_map['height']
-
-    if w > 0 and h > 0:
-        img = Image.open(img_path)
-        assets_file.write(img.tobytes())
-
-def write_font(assets_file, cur_font_dir):
-    font_meta_file = open(os.path.join(cur_font_dir, \
-                                       "font_metrics.json"), "r")
-    metrics_data_map = json.loads(font_meta_file.read())
-    metrics_data_bin = struct.pack("<HHffffI",                         \
-                                   int(metrics_data_map['size']),      \
-                                   int(metrics_data_map['flags']),     \
-                                   float(metrics_data_map['width']),   \
-                                   float(metrics_data_map['height']),  \
-                                   float(metrics_data_map['ascent']),  \
-                                   float(metrics_data_map['descent']), \
-                                   int(metrics_data_map['glyph_count']))
-    assets_file.write(metrics_data_bin)
-    for glyph_no in range(metrics_data_map['glyph_count']):
-        metrics_path = os.path.join(cur_font_dir, \
-                                    "glyph_%d_metrics.json" % glyph_no)
-        img_path = os.path.join(cur_font_dir, "glyph_%d.png" % glyph_no)
-        write_glyph(assets_file, \
-                    metrics_path=metrics_path, img_path=img_path)
-
-def write_img(assets_file, img_path, meta_path):
-    img = Image.open(img_path, "r")
-    img_w, img_h = img.size
-    if image_format == 'zlib':
-        data = zlib.compress(img.tobytes(), 9)
-    else:
-        print("**** BEGIN COMPRESSION OF %s" % img_path)
-        bts = img.tobytes()
-        print("    uncompressed length of %d" % len(bts))
-        data = compress_img(bts)
-    img_meta_file = open(meta_path, "r")
-    img_meta_txt = img_meta_file.read().splitlines()
-    img_meta_data = struct.pack("<HHHH", \
-                                int(img_meta_txt[0], 0), \
-                                int(img_meta_txt[1], 0), \
-                                int(img_meta_txt[2], 0), \
-                                int(img_meta_txt[3], 0))
-    assets_file.write(struct.pack("<HH", img_w, img_h))
-    assets_file.write(img_meta_data)
-    assets_file.write(struct.pack("<I", len(data)))
-    assets_file.write(data)
-
-def write_sound(assets_file, sound_path, meta_path):
-    sound_meta_file = open(meta_path, "r")
-    sound_meta_txt = sound_meta_file.read().splitlines()
-    sound_meta_data = struct.pack("BBBB",
-                                  int(sound_meta_txt[0], 0), \
-                                  int(sound_meta_txt[1], 0), \
-                                  int(sound_meta_txt[2], 0), \
-                                  int(sound_meta_txt[3], 0))
-    sound_file = open(sound_path, "rb")
-    sound_data = sound_file.read()
-
-    assets_file.write(sound_meta_data)
-    assets_file.write(struct.pack("<I", len(sound_data)))
-    assets_file.write(sound_data)
-
-def write_text(assets_file, text_file_path):
-    text_file = open(text_file_path, "rb")
-    text_data = text_file.read()
-    text_len = struct.pack("<I", len(text_data))
-    assets_file.write(text_len)
-    assets_file.write(text_data)
-
-def write_assets_file(assets_file_path, assets_dir_path):
-    init_paths(assets_dir_path)
-    assets_file = open(assets_file_path, "wb")
-
-    preload_file = open(preload_file_path, "rb")
-    preload_data = preload_file.read()
-    preload_file.close()
-
-    assets_file.write(preload_data)
-    if assets_file.tell() != OFFSETS_START:
-        raise ValueError("preload_data has a length of %d (should be %d)" % \
-                         (len(preload_data), OFFSETS_START))
-
-    offset_block_size = 4 * (IMG_COUNT + SOUND_COUNT + FONT_COUNT \
-                             + SHADER_COUNT + FILE_COUNT + TYPE_SIZE_COUNT)
-    assets_file.seek(OFFSETS_START + offset_block_size, os.SEEK_SET)
-
-    img_offsets = []
-    for img_idx in range(IMG_COUNT):
-        if verbose:
-            print("now saving image %d..." % img_idx)
-        img_offsets.append(assets_file.tell())
-
-        write_img(assets_file, \
-                  img_path=os.path.join(img_dir, "img_%d.png" % img_idx), \
-                  meta_path=os.path.join(img_dir, "img_%d_meta.txt" % img_idx))
-
-    sound_offsets = []
-    for sound_idx in range(SOUND_COUNT):
-        if verbose:
-            print("now saving sound %d..." % sound_idx)
-        sound_offsets.append(assets_file.tell())
-
-        sound_path = os.path.join(audio_dir, "audio_%d.ogg" % sound_idx)
-        meta_path = os.path.join(audio_dir, "audio_%d_meta.txt" % sound_idx)
-        write_sound(assets_file, sound_path=sound_path, meta_path=meta_path)
-
-    font_offsets = []
-    for font_idx in range(FONT_COUNT):
-        if verbose:
-            print("now saving font %d..." % font_idx)
-        font_offsets.append(assets_file.tell())
-
-        n_fonts = 0
-        for file_name in os.listdir(font_dir):
-            if re.match("font_\d", file_name):
-                n_fonts += 1
-
-        assets_file.write(struct.pack("<I", n_fonts))
-
-        for font_no in range(n_fonts):
-            cur_font_dir = os.path.join(font_dir, "font_%d" % font_no)
-            write_font(assets_file, cur_font_dir=cur_font_dir)
-
-    shader_offsets = []
-    for shader_idx in range(SHADER_COUNT):
-        if verbose:
-            print("now saving shader %d..." % shader_idx)
-        shader_offsets.append(assets_file.tell())
-
-        vert_path = os.path.join(shader_dir, "shader_%d_vert.glsl" % shader_idx)
-        frag_path = os.path.join(shader_dir, "shader_%d_frag.glsl" % shader_idx)
-
-        write_text(assets_file, text_file_path=vert_path)
-        write_text(assets_file, text_file_path=frag_path)
-
-    file_offsets = []
-    for file_idx in range(FILE_COUNT):
-        if verbose:
-            print("now saving file %d..." % file_idx)
-        file_offsets.append(assets_file.tell())
-
-        file_path = os.path.join(file_dir, "file_%d.txt" % file_idx)
-        write_text(assets_file, text_file_path=file_path)
-
-    # read in the type sizes
-    type_sizes = []
-    type_size_file = open(type_sizes_path, "r")
-    type_size_txt = type_size_file.read().splitlines()
-    for i in range(TYPE_SIZE_COUNT):
-        if verbose:
-            print("now saving type size %d..." % i)
-        ts = int(type_size_txt[i], 0)
-        type_sizes.append(ts)
-
-    if verbose:
-        print("now writing metadata block...")
-    # now write the offsets block and the type sizes
-    assets_file.seek(OFFSETS_START, os.SEEK_SET)
-    for offset in (img_offsets + sound_offsets + font_offsets + \
-                   shader_offsets + file_offsets + type_sizes):
-        assets_file.write(struct.pack("<I", offset))
-
-def extract_all_assets(assets_file_path, assets_dir_path, fmt, raw_images):
-    if os.path.exists(assets_dir_path):
-        print("Error: \"%s\" already exists" % assets_dir_path)
-        exit(1)
-
-    init_paths(assets_dir_path)
-    assets_file = open(assets_file_path, "rb")
-
-    os.mkdir(assets_dir_path, 0o755)
-    os.mkdir(img_dir, 0o755)
-    os.mkdir(audio_dir, 0o755)
-    os.mkdir(shader_dir, 0o755)
-    os.mkdir(file_dir, 0o755)
-    os.mkdir(font_dir, 0o755)
-
-    # read in the preload data.  This doesn't seem to serve any purpose in
-    # Freedom Planet and you can actually zero it out without consequence.
-    # This script dumps it anyways and re-inserts it verbatim when the new
-    # Assets.dat just in case I'm wrong.  At any rate, this keeps binary
-    # patches small.
-    preload_data = assets_file.read(OFFSETS_START)
-    preload_data_file = open(preload_file_path, "wb")
-    preload_data_file.write(preload_data)
-
-    # read in image offsets
-    img_offsets = []
-    for i in range(IMG_COUNT):
-        offset = struct.unpack("<I", assets_file.read(4))[0]
-        img_offsets.append(offset)
-
-    # read in sound offsets
-    sound_offsets = []
-    for i in range(SOUND_COUNT):
-        offset = struct.unpack("<I", assets_file.read(4))[0]
-        sound_offsets.append(offset)
-
-    # read in the font offsets
-    font_offsets = []
-    for i in range(FONT_COUNT):
-        offset = struct.unpack("<I", assets_file.read(4))[0]
-        font_offsets.append(offset)
-
-    # read in the shader offsets
-    shader_offsets = []
-    for i in range(SHADER_COUNT):
-        offset = struct.unpack("<I", assets_file.read(4))[0]
-        shader_offsets.append(offset)
-
-    # read in the file offsets
-    file_offsets = []
-    for i in range(FILE_COUNT):
-        offset = struct.unpack("<I", assets_file.read(4))[0]
-        file_offsets.append(offset)
-
-    type_sizes = []
-    for i in range(TYPE_SIZE_COUNT):
-        ts = struct.unpack("<I", assets_file.read(4))[0]
-        type_sizes.append(ts)
-
-    # write the type sizes
-    type_size_file = open(type_sizes_path, "w")
-    for ts in type_sizes:
-        type_size_file.write("0x%x\n" % ts)
-
-    if raw_images:
-        img_ext = "bin"
-    else:
-        img_ext = "png"
-    for index, offset in enumerate(img_offsets):
-        print("preparing to extract image %d..." % index)
-        assets_file.seek(offset)
-        extract_img(assets_file, "img_%d.%s" % (index, img_ext), \
-                    "img_%d_meta.txt" % index, raw_images)
-
-    for index, offset in enumerate(sound_offsets):
-        assets_file.seek(offset)
-
-        # Here there are 4 unknown bytes followed by a 4-byte length and then
-        # an ogg file
-        meta_txt = open(os.path.join(audio_dir, \
-                                     "audio_%d_meta.txt" % index), "w")
-        for i in range(4):
-            meta_txt.write("0x%x\n" % struct.unpack("B", assets_file.read(1))[0])
-
-        file_len = struct.unpack("<I", assets_file.read(4))[0]
-        file_dat = assets_file.read(file_len)
-        out_file = open(os.path.join(audio_dir, "audio_%d.ogg" % index), "wb")
-        out_file.write(file_dat)
-
-    # next read in fonts
-    for index, offset in enumerate(font_offsets):
-        assets_file.seek(offset)
-
-        n_fonts = struct.unpack("<I", assets_file.read(4))[0]
-
-        for font_no in range(n_fonts):
-            extract_font(assets_file, \
-                         os.path.join(font_dir, "font_%d" % font_no))
-
-    # next read in shaders.  These are just 4-byte lengths followed by text
-    for index, offset in enumerate(shader_offsets):
-        assets_file.seek(offset)
-        extract_text(assets_file, os.path.join(shader_dir, \
-                                               "shader_%d_vert.glsl" % index))
-        extract_text(assets_file, os.path.join(assets_dir_path, "shaders", \
-                                               "shader_%d_frag.glsl" % index))
-
-    # next read in files.  These are just 4-byte lengths followed by text.
-    for index, offset in enumerate(file_offsets):
-        assets_file.seek(offset)
-        extract_text(assets_file, os.path.join(assets_dir_path, "files", \
-                                               "file_%d.txt" % index))
-
-    # save metadata so we have it on hand when we create a new Assets.dat
-    fmt_file = open(os.path.join(assets_dir_path, "format.json"), "w")
-    json.dump(fmt, fmt_file, indent=4)
-    fmt_file.close()
-
-def md5sum(path):
-    hasher = hashlib.md5()
-    stream = open(path, "rb")
-    buf = stream.read(4096)
-    while buf:
-        hasher.update(buf)
-        buf = stream.read(4096)
-    stream.close()
-    return hasher.hexdigest()
+    if metadata_json is not None:
+        try:
+            return load_format(metadata_json)
+        except FileNotFoundError:
+            print("ERROR: unable to open %s ; please proved path to a valid metadata json file with the -m option" % metadata_json, file = sys.stderr)
+            exit(1)
 
+    csum = md5sum(assets_file_path)
+    print("assets file has a checksum of %s" % csum)
+    fmt = known_format(csum)
+    if fmt is None:
+        print("unrecognized assets file with md5sum %s" % csum)
+        print("you will need to supply your own metadata json files with the -m option")
+        exit(1)
+    print("csum %s is recognized as an official release, and its metadata is known" % csum)
+    return fmt
 
 if __name__ == "__main__":
     do_extract = False
     do_compress = False
+    do_diff = False
+    do_apply = False
     metadata_json = None
     raw_images = False
+    atlas = False
+    do_serve = False
+    port = 8000
+    n_jobs = None
+    do_analyze = False
+    sort_field = "compressed_len"
+    report_path = None
+    recompress = False
+    resume = False
+    use_sqlite = False
+    pixels = False
+    cache_dir = None
+    cache_size = None
+    clear_alpha = False
+    pipeline = False
+    decode_jobs = None
+    write_jobs = None
+    do_scan = False
+    do_build_lookup = False
+    do_lookup = False
+    use_dhash = False
+    daemon_socket = None
     try:
-        opt_val, params = getopt(sys.argv[1:], "xcf:m:rv", ["file="])
+        opt_val, params = getopt(sys.argv[1:], "xcf:m:ravj:", \
+                                 ["file=", "diff", "apply", "serve", "port=", \
+                                  "analyze", "sort=", "report=", \
+                                  "recompress", "resume", "sqlite", \
+                                  "pixels", "cache=", "cache-size=", \
+                                  "clear-alpha", "pipeline", "decode-jobs=", \
+                                  "write-jobs=", "scan", \
+                                  "build-lookup", "lookup", "dhash", \
+                                  "daemon="])
         for option, value in opt_val:
             if option == "-f" or option == "--in-file":
                 assets_file_path = value
@@ -516,12 +142,182 @@ if __name__ == "__main__":
                 metadata_json = value
             elif option == "-r":
                 raw_images = True
+            elif option == "-a":
+                atlas = True
             elif option == "-v":
                 verbose = True
-    except GetoptError:
+            elif option == "--diff":
+                do_diff = True
+            elif option == "--apply":
+                do_apply = True
+            elif option == "--serve":
+                do_serve = True
+            elif option == "--port":
+                port = int(value)
+            elif option == "-j":
+                n_jobs = int(value)
+            elif option == "--analyze":
+                do_analyze = True
+            elif option == "--sort":
+                sort_field = value
+            elif option == "--report":
+                report_path = value
+            elif option == "--recompress":
+                recompress = True
+            elif option == "--resume":
+                resume = True
+            elif option == "--sqlite":
+                use_sqlite = True
+            elif option == "--pixels":
+                pixels = True
+            elif option == "--cache":
+                cache_dir = value
+            elif option == "--cache-size":
+                cache_size = int(value) * 1024 * 1024
+            elif option == "--clear-alpha":
+                clear_alpha = True
+            elif option == "--pipeline":
+                pipeline = True
+            elif option == "--decode-jobs":
+                decode_jobs = int(value)
+            elif option == "--write-jobs":
+                write_jobs = int(value)
+            elif option == "--scan":
+                do_scan = True
+            elif option == "--build-lookup":
+                do_build_lookup = True
+            elif option == "--lookup":
+                do_lookup = True
+            elif option == "--dhash":
+                use_dhash = True
+            elif option == "--daemon":
+                daemon_socket = value
+    except (GetoptError, ValueError):
         print(usage_string)
         exit(1)
 
+    if decode_jobs is None:
+        decode_jobs = n_jobs
+    if write_jobs is None:
+        write_jobs = n_jobs
+
+    if daemon_socket is not None:
+        from fpdaemon import run_daemon
+        try:
+            run_daemon(daemon_socket, n_jobs=n_jobs)
+        except ValueError as err:
+            print("Error: %s" % err)
+            exit(1)
+        exit(0)
+
+    if do_serve:
+        from fpserve import serve_assets
+        fmt = identify_format(assets_file_path, metadata_json)
+        serve_assets(assets_file_path, fmt, port, n_threads=n_jobs, \
+                     verbose=verbose)
+        exit(0)
+
+    if do_analyze:
+        from fpanalyze import analyze_assets, sort_report, save_report, \
+            print_report
+        fmt = identify_format(assets_file_path, metadata_json)
+        rows = analyze_assets(assets_file_path, fmt, n_jobs=n_jobs, \
+                              recompress=recompress)
+        try:
+            rows = sort_report(rows, sort_field)
+        except ValueError as err:
+            print("ERROR: %s" % err, file=sys.stderr)
+            exit(1)
+        if report_path is not None:
+            save_report(rows, report_path)
+        print_report(rows)
+        exit(0)
+
+    if do_scan:
+        fmt = identify_format(assets_file_path, metadata_json)
+        errors = scan_assets(assets_file_path, fmt, verbose=verbose)
+        for err in errors:
+            print(err)
+        if errors:
+            print("found %d problems" % len(errors))
+            exit(1)
+        print("no problems found")
+        exit(0)
+
+    if do_build_lookup:
+        from fplookup import build_lookup_index, save_lookup_index
+        fmt = identify_format(assets_file_path, metadata_json)
+        lookup_index = build_lookup_index(assets_file_path, fmt, \
+                                          n_jobs=n_jobs, use_dhash=use_dhash)
+        save_lookup_index(assets_file_path, lookup_index)
+        print("indexed %d images" % len(lookup_index['images']))
+        exit(0)
+
+    if do_lookup:
+        from fplookup import load_lookup_index, image_lookup
+        if len(params) == 0:
+            print(usage_string)
+            exit(1)
+        lookup_index = load_lookup_index(assets_file_path)
+        if lookup_index is None:
+            print("Error: no up-to-date lookup index for %s; make one with --build-lookup" % assets_file_path)
+            exit(1)
+        lookup = image_lookup(lookup_index)
+        for png_path in params:
+            try:
+                matches = lookup.find_png(png_path)
+            except OSError as err:
+                print("%s: %s" % (png_path, err))
+                continue
+            if not matches:
+                print("%s: no match" % png_path)
+            for index, distance in matches:
+                if distance is not None:
+                    print("%s: img_%d (dhash distance %d)" % \
+                          (png_path, index, distance))
+                else:
+                    print("%s: img_%d" % (png_path, index))
+        exit(0)
+
+    if do_diff or do_apply:
+        if len(params) != 2:
+            print(usage_string)
+            exit(1)
+        if do_diff and do_apply:
+            print("Error: cannot both diff (--diff) and apply (--apply) at the same time")
+            exit(1)
+
+    if do_diff:
+        base_fmt = identify_format(assets_file_path, metadata_json)
+        new_fmt = known_format(md5sum(params[0]))
+        if new_fmt is None:
+            new_fmt = base_fmt
+        try:
+            n_changed, n_entries = \
+                diff_assets(base_path=assets_file_path, base_fmt=base_fmt, \
+                            new_path=params[0], new_fmt=new_fmt, \
+                            patch_path=params[1], verbose=verbose)
+        except ValueError as err:
+            print("ERROR: %s" % err, file=sys.stderr)
+            exit(1)
+        print("%d of %d entries changed; patch is %d bytes" % \
+              (n_changed, n_entries, os.path.getsize(params[1])))
+        exit(0)
+
+    if do_apply:
+        try:
+            out_csum = apply_patch(base_path=assets_file_path, \
+                                   patch_path=params[0], out_path=params[1], \
+                                   verbose=verbose)
+        except ValueError as err:
+            print("ERROR: %s" % err, file=sys.stderr)
+            exit(1)
+        print("patched assets file has md5sum %s" % out_csum)
+        exit(0)
+
+    if use_sqlite:
+        assets_dir_path = "Assets.sqlite"
+
     if len(params) == 1:
         assets_dir_path = params[0]
     elif len(params) != 0:
@@ -536,78 +332,61 @@ if __name__ == "__main__":
         print("Error: cannot both compress (-c) and extract (-x) at the same time")
         exit(1)
 
-    if do_extract:
-        csum = md5sum(assets_file_path)
-        print("assets file has a checksum of %s" % csum)
-        if metadata_json is None:
-            # latest version (as of may 2023).  fb95f5c is linux, 4085c98 is windows, 97fa3c33c is shitendo switch.
-            if csum == "fb95f5c4809e76cae933be20ca51a660" or csum == "4085c983fb918703ce459f17f69c474c" or csum == "97fa3c33c6fc72bece978c06cacf3ebf":
-                format_string = """
-                {
-                "OFFSETS_START" : 34324,
-                "IMG_COUNT"  : 17162,
-                "SOUND_COUNT" : 475,
-                "FONT_COUNT" : 0,
-                "SHADER_COUNT" : 95,
-                "FILE_COUNT" : 18,
-                "TYPE_SIZE_COUNT" : 5,
-                "image_format" : "chowdren"
-                }
-                """
-            elif csum == "f14f24317d0323d63231cdbba511f254":
-                format_string = """
-                {
-                "OFFSETS_START" : 33786,
-                "IMG_COUNT" : 16893,
-                "SOUND_COUNT" : 475,
-                "FONT_COUNT" : 1,
-                "SHADER_COUNT" : 37,
-                "FILE_COUNT" : 18,
-                "TYPE_SIZE_COUNT" : 5,
-                "image_format" : "zlib"
-                }
-                """
+    if raw_images and atlas:
+        print("Error: raw images (-r) can't be packed into an atlas (-a)")
+        exit(1)
+
+    if use_sqlite and (raw_images or atlas or resume):
+        print("Error: -r, -a and --resume don't apply to a database (--sqlite)")
+        exit(1)
+
+    if use_sqlite:
+        from fpstore import extract_to_db, write_assets_file_from_db
+        try:
+            if do_extract:
+                fmt = identify_format(assets_file_path, metadata_json)
+                extract_to_db(assets_file_path, assets_dir_path, fmt, \
+                              pixels=pixels, verbose=verbose)
             else:
-                print("unrecognized assets file with md5sum %s" % csum)
-                print("you will need to supply your own metadata json files with the -m option")
-                exit(1)
-            print("csum %s is recognized as an official release, and its metadata is known" % csum)
-        else:
-            metadata_file = open(metadata_json, "r")
-            format_string = metadata_file.read()
-            metadata_file.close()
-
-        fmt = json.loads(format_string)
-        OFFSETS_START = int(fmt['OFFSETS_START'])
-        IMG_COUNT = int(fmt['IMG_COUNT'])
-        SOUND_COUNT = int(fmt['SOUND_COUNT'])
-        FONT_COUNT = int(fmt['FONT_COUNT'])
-        SHADER_COUNT = int(fmt['SHADER_COUNT'])
-        FILE_COUNT = int(fmt['FILE_COUNT'])
-        TYPE_SIZE_COUNT = int(fmt['TYPE_SIZE_COUNT'])
-        image_format = fmt['image_format']
-
-        extract_all_assets(assets_file_path=assets_file_path, \
-                           assets_dir_path=assets_dir_path,
-                           fmt=fmt, raw_images=raw_images)
+                write_assets_file_from_db(assets_file_path, assets_dir_path, \
+                                          clear_alpha=clear_alpha, \
+                                          verbose=verbose)
+        except (ValueError, FileExistsError) as err:
+            print("Error: %s" % err)
+            exit(1)
+        exit(0)
+
+    if do_extract:
+        if os.path.exists(assets_dir_path) and not resume:
+            print("Error: \"%s\" already exists" % assets_dir_path)
+            exit(1)
+
+        fmt = identify_format(assets_file_path, metadata_json)
+        cache = None
+        if cache_dir is not None:
+            from fpcache import decode_cache, DECODE_CACHE_SIZE
+            if cache_size is None:
+                cache_size = DECODE_CACHE_SIZE
+            cache = decode_cache(cache_dir, cache_size)
+        try:
+            extract_all_assets(assets_file_path=assets_file_path, \
+                               assets_dir_path=assets_dir_path,
+                               fmt=fmt, raw_images=raw_images, atlas=atlas, \
+                               resume=resume, cache=cache, \
+                               pipeline=pipeline, decode_jobs=decode_jobs, \
+                               write_jobs=write_jobs, \
+                               verbose=verbose)
+        except (ValueError, FileExistsError) as err:
+            print("Error: %s" % err)
+            exit(1)
+        if cache is not None:
+            print("%d images came from the cache, %d had to be decoded" % \
+                  (cache.hits, cache.misses))
 
     if do_compress:
         if metadata_json is None:
             metadata_json = os.path.join(assets_dir_path, 'format.json')
-        try:
-            with open(metadata_json, 'r') as meta_file:
-                format_string = meta_file.read()
-                fmt = json.loads(format_string)
-                OFFSETS_START = int(fmt['OFFSETS_START'])
-                IMG_COUNT = int(fmt['IMG_COUNT'])
-                SOUND_COUNT = int(fmt['SOUND_COUNT'])
-                FONT_COUNT = int(fmt['FONT_COUNT'])
-                SHADER_COUNT = int(fmt['SHADER_COUNT'])
-                FILE_COUNT = int(fmt['FILE_COUNT'])
-                TYPE_SIZE_COUNT = int(fmt['TYPE_SIZE_COUNT'])
-                image_format = fmt['image_format']
-        except FileNotFoundError:
-            print("ERROR: unable to open %s ; please proved path to a valid metadata json file with the -m option" % metadata_json, file = sys.stderr)
-            exit(1)
+        fmt = identify_format(assets_file_path, metadata_json)
 
-        write_assets_file(assets_file_path, assets_dir_path)
+        write_assets_file(assets_file_path, assets_dir_path, fmt, \
+                          clear_alpha=clear_alpha, verbose=verbose)
@@ -0,0 +1,154 @@
+################################################################################
+#
+# contact: snickerbockers@washemu.org
+#
+# I choose to release this file into the public domain.
+# I am not responsible for any failures of this program or damage caused by it.
+# You have the right to remove this statement, but I'd prefer it if you didn't.
+#     -- SnickerBockers was here, 2023
+#
+################################################################################
+
+# Compression report for the images in an Assets.dat, to find out which
+# sprites take up the most space and which ones compress badly.
+#
+# For every image this reports its compressed and raw sizes and, for
+# chowdren-compressed images, how the hunk stream was put together: how much
+# of it is literals versus replays, how long the replays are on average and
+# how far back they reach.  Optionally each image is also recompressed (with
+# zlib level 9 or with chowimg's compressor, depending on the format) to see
+# how much there is to gain.  chowimg's compressor is pure python, so that
+# takes a long time for the whole archive.
+#
+# The images are split up between a pool of worker processes (see
+# fpassets.map_images).
+
+import csv
+import json
+import zlib
+from chowimg import img_stats, compress_img, REWIND_BUCKETS
+from fpassets import map_images
+
+REWIND_FIELDS = ["rewind_le_%d" % upper for upper in REWIND_BUCKETS]
+
+# columns of the report, in order
+REPORT_FIELDS = ["index", "width", "height", "raw_len", "compressed_len", \
+                 "ratio", "hunks", "literal_bytes", "match_bytes", \
+                 "match_ratio", "replays", "avg_replay_len"] + \
+                REWIND_FIELDS + ["recompressed_len", "savings"]
+
+def analyze_img(archive, index, recompress=False):
+    """
+    returns the report row (a dict with the keys in REPORT_FIELDS) for image
+    index of archive.  Fields that don't apply are None.
+    """
+    img_w, img_h, meta, file_len = archive.img_header(index)
+    row = dict.fromkeys(REPORT_FIELDS)
+    row['index'] = index
+    row['width'] = img_w
+    row['height'] = img_h
+    row['raw_len'] = img_w * img_h * 4
+    row['compressed_len'] = file_len
+    if row['raw_len']:
+        row['ratio'] = file_len / row['raw_len']
+
+    if archive.fmt.image_format == 'chowdren':
+        stats = img_stats(archive.img_blob(index))
+        row['hunks'] = stats['hunks']
+        row['literal_bytes'] = stats['literal_bytes']
+        row['match_bytes'] = stats['match_bytes']
+        row['replays'] = stats['replays']
+        total = stats['literal_bytes'] + stats['match_bytes']
+        if total:
+            row['match_ratio'] = stats['match_bytes'] / total
+        if stats['replays']:
+            row['avg_replay_len'] = stats['match_bytes'] / stats['replays']
+        for field, count in zip(REWIND_FIELDS, stats['rewind_hist']):
+            row[field] = count
+
+    if recompress:
+        img_w, img_h, bts = archive.decode_img(index)
+        if archive.fmt.image_format == 'zlib':
+            row['recompressed_len'] = len(zlib.compress(bts, 9))
+        else:
+            row['recompressed_len'] = len(compress_img(bts, quiet=True))
+        row['savings'] = file_len - row['recompressed_len']
+    return row
+
+def analyze_assets(assets_file_path, fmt, n_jobs=None, recompress=False):
+    """
+    build the compression report for every image in the Assets.dat at
+    assets_file_path, which is described by the assets_format fmt.  Returns
+    a list of rows in index order (see analyze_img).
+    """
+    return map_images(assets_file_path, fmt, analyze_img, (recompress,), \
+                      n_jobs)
+
+def sort_report(rows, field, descending=True):
+    """
+    sort rows by field.  Rows where field is None always go last.
+    """
+    if field not in REPORT_FIELDS:
+        raise ValueError("unknown report field \"%s\"" % field)
+    known = [row for row in rows if row[field] is not None]
+    unknown = [row for row in rows if row[field] is None]
+    known.sort(key=lambda row: row[field], reverse=descending)
+    return known + unknown
+
+def save_report(rows, report_path):
+    """
+    save rows to report_path, as json if it ends in .json or csv otherwise
+    """
+    if report_path.rpartition('.')[2].casefold() == 'json':
+        with open(report_path, "w") as report_file:
+            json.dump(rows, report_file, indent=1)
+        return
+
+    with open(report_path, "w", newline="") as report_file:
+        writer = csv.DictWriter(report_file, fieldnames=REPORT_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+def report_summary(rows):
+    """
+    returns a dict of totals over every row
+    """
+    summary = { 'images' : len(rows), 'raw_len' : 0, 'compressed_len' : 0,
+                'literal_bytes' : 0, 'match_bytes' : 0, 'savings' : None }
+    for row in rows:
+        summary['raw_len'] += row['raw_len']
+        summary['compressed_len'] += row['compressed_len']
+        if row['literal_bytes'] is not None:
+            summary['literal_bytes'] += row['literal_bytes']
+            summary['match_bytes'] += row['match_bytes']
+        if row['savings'] is not None:
+            summary['savings'] = (summary['savings'] or 0) + row['savings']
+    return summary
+
+def print_report(rows, n_rows=20):
+    """
+    print the first n_rows rows as a table followed by the totals
+    """
+    columns = ["index", "width", "height", "raw_len", "compressed_len", \
+               "ratio", "hunks", "match_ratio", "avg_replay_len", "savings"]
+    print(" ".join("%14s" % col for col in columns))
+    for row in rows[:n_rows]:
+        vals = []
+        for col in columns:
+            val = row[col]
+            if val is None:
+                vals.append("%14s" % "-")
+            elif isinstance(val, float):
+                vals.append("%14.3f" % val)
+            else:
+                vals.append("%14d" % val)
+        print(" ".join(vals))
+
+    summary = report_summary(rows)
+    print("%d images, %d bytes compressed out of %d raw" % \
+          (summary['images'], summary['compressed_len'], summary['raw_len']))
+    if summary['literal_bytes'] or summary['match_bytes']:
+        print("%d literal bytes, %d bytes from replays" % \
+              (summary['literal_bytes'], summary['match_bytes']))
+    if summary['savings'] is not None:
+        print("recompressing would save %d bytes" % summary['savings'])
@@ -0,0 +1,1767 @@
+################################################################################
+#
+# contact: snickerbockers@washemu.org
+#
+# I choose to release this file into the public domain.
+# I am not responsible for any failures of this program or damage caused by it.
+# You have the right to remove this statement, but I'd prefer it if you didn't.
+#     -- SnickerBockers was here, 2016, 2023
+#
+################################################################################
+
+# fpassets is the library behind fp-assets.py.  Nothing in here is stored in
+# module-level state; everything that depends on which Assets.dat you're
+# working with is passed in as an assets_format and an assets_paths, so it's
+# safe to work on several archives at once from different threads.
+#
+# PIL is only imported by the functions which actually need it so that
+# commands which never touch an image don't have to pay for it.
+
+import re
+import struct
+import os
+import shutil
+import zlib
+import json
+import hashlib
+import io
+import mmap
+import time
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from chowimg import load_img, load_img_range, compress_img, check_img
+from fpatlas import atlas_writer, atlas_reader, has_atlas, shelf_packer
+from fppipeline import run_pipeline
+
+# the order in which each class of asset appears in the metadata block, and
+# the key in format.json that holds how many of them there are.  The type
+# sizes come after all of these.
+ASSET_CLASSES = (("img", "IMG_COUNT"), ("sound", "SOUND_COUNT"),
+                 ("font", "FONT_COUNT"), ("shader", "SHADER_COUNT"),
+                 ("file", "FILE_COUNT"))
+TYPE_SIZE_CLASS = (("type_sizes", "TYPE_SIZE_COUNT"),)
+
+# metadata that is hard-coded into each official release, keyed by the md5sum
+# of its Assets.dat.
+# latest version (as of may 2023).  fb95f5c is linux, 4085c98 is windows,
+# 97fa3c33c is shitendo switch.
+LATEST_FORMAT = {
+    "OFFSETS_START" : 34324,
+    "IMG_COUNT"  : 17162,
+    "SOUND_COUNT" : 475,
+    "FONT_COUNT" : 0,
+    "SHADER_COUNT" : 95,
+    "FILE_COUNT" : 18,
+    "TYPE_SIZE_COUNT" : 5,
+    "image_format" : "chowdren"
+}
+KNOWN_FORMATS = {
+    "fb95f5c4809e76cae933be20ca51a660" : LATEST_FORMAT,
+    "4085c983fb918703ce459f17f69c474c" : LATEST_FORMAT,
+    "97fa3c33c6fc72bece978c06cacf3ebf" : LATEST_FORMAT,
+    "f14f24317d0323d63231cdbba511f254" : {
+        "OFFSETS_START" : 33786,
+        "IMG_COUNT" : 16893,
+        "SOUND_COUNT" : 475,
+        "FONT_COUNT" : 1,
+        "SHADER_COUNT" : 37,
+        "FILE_COUNT" : 18,
+        "TYPE_SIZE_COUNT" : 5,
+        "image_format" : "zlib"
+    }
+}
+
+class assets_format:
+    """
+    the metadata hard-coded into each version of the game that's needed to make
+    sense of its Assets.dat (see "how metadata works" in README.md).  The
+    attributes have the same names as the keys in format.json.
+    """
+    def __init__(self, fmt):
+        self.OFFSETS_START = int(fmt['OFFSETS_START'])
+        self.IMG_COUNT = int(fmt['IMG_COUNT'])
+        self.SOUND_COUNT = int(fmt['SOUND_COUNT'])
+        self.FONT_COUNT = int(fmt['FONT_COUNT'])
+        self.SHADER_COUNT = int(fmt['SHADER_COUNT'])
+        self.FILE_COUNT = int(fmt['FILE_COUNT'])
+        self.TYPE_SIZE_COUNT = int(fmt['TYPE_SIZE_COUNT'])
+        self.image_format = fmt['image_format']
+
+    def offset_block_len(self):
+        """
+        length of the metadata block (all the offsets plus the type sizes)
+        """
+        n_offsets = 0
+        for asset_class, count_key in ASSET_CLASSES + TYPE_SIZE_CLASS:
+            n_offsets += getattr(self, count_key)
+        return 4 * n_offsets
+
+    def to_json(self):
+        """
+        returns this format as a dict suitable for saving to format.json
+        """
+        return {
+            "OFFSETS_START" : self.OFFSETS_START,
+            "IMG_COUNT" : self.IMG_COUNT,
+            "SOUND_COUNT" : self.SOUND_COUNT,
+            "FONT_COUNT" : self.FONT_COUNT,
+            "SHADER_COUNT" : self.SHADER_COUNT,
+            "FILE_COUNT" : self.FILE_COUNT,
+            "TYPE_SIZE_COUNT" : self.TYPE_SIZE_COUNT,
+            "image_format" : self.image_format
+        }
+
+class assets_paths:
+    """
+    where everything goes in a directory of extracted assets
+    """
+    def __init__(self, assets_dir_path):
+        self.assets_dir_path = assets_dir_path
+        self.img_dir = os.path.join(assets_dir_path, "images")
+        self.audio_dir = os.path.join(assets_dir_path, "audio")
+        self.shader_dir = os.path.join(assets_dir_path, "shaders")
+        self.file_dir = os.path.join(assets_dir_path, "files")
+        self.font_dir = os.path.join(assets_dir_path, "fonts")
+
+        self.preload_file_path = os.path.join(assets_dir_path, \
+                                              "preload_data.bin")
+        self.type_sizes_path = os.path.join(assets_dir_path, "type_sizes.txt")
+        self.format_path = os.path.join(assets_dir_path, "format.json")
+        self.journal_path = os.path.join(assets_dir_path, \
+                                         "extract_journal.txt")
+
+# width, height, the four mystery integers and the compressed length
+IMG_HEADER = struct.Struct("<HHHHHHI")
+
+# the header of each font, and of each glyph in a font.  The names of the
+# fields are the keys used for them in font_metrics.json and the glyph
+# metrics json files.
+FONT_HEADER = struct.Struct("<HHffffI")
+FONT_FIELDS = ("size", "flags", "width", "height", "ascent", "descent", \
+               "glyph_count")
+GLYPH_HEADER = struct.Struct("<IffffffffII")
+GLYPH_FIELDS = ("charcode", "x1", "y1", "x2", "y2", "advance_x", \
+                "advance_y", "corner_x", "corner_y", "width", "height")
+
+# where extract_glyph_atlas saves the glyphs of each font
+GLYPH_TABLE_NAME = "glyphs.json"
+GLYPH_ATLAS_NAME = "glyphs.png"
+
+# first eight bytes of every patch made by diff_assets
+PATCH_MAGIC = b"FPPATCH1"
+
+# size of the buffer copy_range falls back on when the OS can't copy
+# between files for us
+COPY_CHUNK_SIZE = 1024 * 1024
+
+def copy_range(src_file, src_offset, dst_file, count):
+    """
+    copy count bytes starting at src_offset in src_file to the current position
+    of dst_file.  Sounds and text are stored verbatim, so there's no reason to
+    drag them through python; this uses copy_file_range or sendfile when the OS
+    has them and only falls back to a chunked read/write loop when neither
+    works.  Afterwards both files are positioned just past the copied bytes.
+    """
+    dst_file.flush()
+    dst_offset = dst_file.tell()
+    src_fd = src_file.fileno()
+    dst_fd = dst_file.fileno()
+    copied = 0
+
+    try:
+        while copied < count:
+            n_bytes = os.copy_file_range(src_fd, dst_fd, count - copied, \
+                                         src_offset + copied, \
+                                         dst_offset + copied)
+            if n_bytes == 0:
+                break
+            copied += n_bytes
+    except (AttributeError, OSError):
+        # no copy_file_range on this platform, or the kernel/filesystem
+        # won't do it for these two files
+        pass
+
+    if copied < count:
+        try:
+            os.lseek(dst_fd, dst_offset + copied, os.SEEK_SET)
+            while copied < count:
+                n_bytes = os.sendfile(dst_fd, src_fd, src_offset + copied, \
+                                      count - copied)
+                if n_bytes == 0:
+                    break
+                copied += n_bytes
+        except (AttributeError, OSError):
+            pass
+
+    if copied < count:
+        src_file.seek(src_offset + copied)
+        dst_file.seek(dst_offset + copied)
+        while copied < count:
+            buf = src_file.read(min(COPY_CHUNK_SIZE, count - copied))
+            if not buf:
+                break
+            dst_file.write(buf)
+            copied += len(buf)
+        dst_file.flush()
+
+    if copied != count:
+        raise ValueError("unexpected end of file: only copied %d of %d bytes" % \
+                         (copied, count))
+
+    src_file.seek(src_offset + count)
+    dst_file.seek(dst_offset + count)
+
+def extract_glyph(assets_file, metrics_path, img_path):
+    """
+    reads in a glyph from assets_file and saves the metrics
+    to a json and the glyph itself to a png.
+
+    metrics_path is the name of the file that will hold the metrics.
+    img_path is the name of the file that will hold the image.
+    """
+    metrics = dict(zip(GLYPH_FIELDS, \
+                       GLYPH_HEADER.unpack(assets_file.read(GLYPH_HEADER.size))))
+
+    with open(metrics_path, "w") as metrics_file:
+        metrics_file.write(json.dumps(metrics))
+
+    w = metrics['width']
+    h = metrics['height']
+
+    if w > 0 and h > 0:
+        from PIL import Image
+        raw_img = assets_file.read(w * h)
+        out_img = Image.frombytes("L", (w, h), raw_img)
+        out_img.save(img_path)
+
+def extract_glyph_atlas(assets_file, cur_font_dir, glyph_count):
+    """
+    reads glyph_count glyphs from assets_file and saves all of their metrics to
+    a single table in glyphs.json and all of their bitmaps to a single L-mode
+    glyphs.png under cur_font_dir.  Each glyph's entry in the table is the
+    same as what extract_glyph would save plus its x/y position in glyphs.png.
+    """
+    from PIL import Image
+    glyphs = []
+    bitmaps = []
+    for glyph_no in range(glyph_count):
+        metrics = dict(zip(GLYPH_FIELDS, \
+                           GLYPH_HEADER.unpack(assets_file.read(GLYPH_HEADER.size))))
+        bitmaps.append(assets_file.read(metrics['width'] * metrics['height']))
+        glyphs.append(metrics)
+
+    # pack the tallest glyphs first so the shelves stay full, and make the
+    # atlas roughly square
+    area = 0
+    sheet_w = 1
+    sheet_h = 1
+    for metrics in glyphs:
+        area += metrics['width'] * metrics['height']
+        sheet_w = max(sheet_w, metrics['width'])
+        sheet_h += metrics['height']
+    sheet_w = max(sheet_w, int(area ** 0.5) + 1)
+    packer = shelf_packer(sheet_w, sheet_h)
+    positions = [(0, 0)] * glyph_count
+    for glyph_no in sorted(range(glyph_count), \
+                           key=lambda glyph_no: -glyphs[glyph_no]['height']):
+        w = glyphs[glyph_no]['width']
+        h = glyphs[glyph_no]['height']
+        if w > 0 and h > 0:
+            positions[glyph_no] = packer.place(w, h)
+
+    sheet = Image.new("L", (max(packer.used_w, 1), max(packer.used_h, 1)))
+    for glyph_no, metrics in enumerate(glyphs):
+        metrics['x'], metrics['y'] = positions[glyph_no]
+        w = metrics['width']
+        h = metrics['height']
+        if w > 0 and h > 0:
+            sheet.paste(Image.frombytes("L", (w, h), bitmaps[glyph_no]), \
+                        positions[glyph_no])
+    sheet.save(os.path.join(cur_font_dir, GLYPH_ATLAS_NAME))
+
+    with open(os.path.join(cur_font_dir, GLYPH_TABLE_NAME), "w") as table_file:
+        json.dump({ "atlas" : GLYPH_ATLAS_NAME, "glyphs" : glyphs }, \
+                  table_file)
+
+def extract_font(assets_file, cur_font_dir, atlas=False):
+    """
+    reads a font in from assets_file, saves the metrics to a json,
+    and then calls read_glyph for each glyph in the font.
+    All font-data will be saved under cur_font_dir.
+    assets_file should be seek'd to the beginning of the font data before
+    calling this function.  If atlas is True the glyphs are saved with
+    extract_glyph_atlas instead.
+    """
+    os.mkdir(cur_font_dir, 0o755)
+
+    font_metrics = dict(zip(FONT_FIELDS, \
+                            FONT_HEADER.unpack(assets_file.read(FONT_HEADER.size))))
+
+    with open(os.path.join(cur_font_dir, \
+                           "font_metrics.json"), "w") as metrics_file:
+        metrics_file.write(json.dumps(font_metrics))
+
+    if atlas:
+        extract_glyph_atlas(assets_file, cur_font_dir, \
+                            font_metrics['glyph_count'])
+        return
+
+    for glyph_no in range(font_metrics['glyph_count']):
+        glyph_metrics_path = os.path.join(cur_font_dir, \
+                                          "glyph_%d_metrics.json" % glyph_no)
+        glyph_img_path = os.path.join(cur_font_dir, "glyph_%d.png" % glyph_no)
+        extract_glyph(assets_file, metrics_path=glyph_metrics_path, \
+                      img_path=glyph_img_path)
+
+def decode_img(fmt, assets_file, file_len):
+    """
+    decompress file_len bytes of image data from assets_file using whichever
+    compression scheme fmt says this version of the game uses.  Returns the
+    uncompressed RGBA data.
+    """
+    if fmt.image_format == 'chowdren':
+        return bytes(load_img(assets_file, file_len))
+    elif fmt.image_format == 'zlib':
+        return zlib.decompress(assets_file.read(file_len))
+    raise ValueError("unknown image compression format %s" % fmt.image_format)
+
+def decode_img_range(fmt, dat, start, stop=None):
+    """
+    decode only bytes start through stop (exclusive) of the compressed image
+    data dat, without decoding anything past stop.  Chowdren images also skip
+    every hunk before start (see chowimg.load_img_range); zlib has to start
+    from the beginning but stops as soon as it gets to stop.
+    """
+    if fmt.image_format == 'chowdren':
+        return load_img_range(dat, start, stop)
+    elif fmt.image_format == 'zlib':
+        decomp = zlib.decompressobj()
+        if stop is None:
+            return (decomp.decompress(dat) + decomp.flush())[start:]
+        out = bytearray()
+        pending = dat
+        while len(out) < stop and pending:
+            out += decomp.decompress(pending, stop - len(out))
+            pending = decomp.unconsumed_tail
+        return bytes(out[start:stop])
+    raise ValueError("unknown image compression format %s" % fmt.image_format)
+
+# default size of the box img_thumbnail fits images into
+THUMBNAIL_SIZE = 128
+
+def read_img_header(assets_file):
+    """
+    read the header that comes before every image in Assets.dat (see below).
+    Returns a tuple of (width, height, meta, compressed length), where meta is
+    a list of the four mystery integers.
+    """
+    header = IMG_HEADER.unpack(assets_file.read(IMG_HEADER.size))
+    return (header[0], header[1], list(header[2:6]), header[6])
+
+# Format of images in Assets.dat:
+#     width (16 bits)
+#     height (16 bits)
+#     The four mystery integers (16 bits * 4)
+#     Compressed file length (32-bits)
+#     32-bit RGBA image data, compressed using either zlib or a custom algorithm (see chowimg.py)
+#
+# These are all little-endian values.
+def decode_img_cached(fmt, assets_file, file_len, cache=None):
+    """
+    same as decode_img, but if cache is a decode_cache (see fpcache.py) the
+    decoded data is looked up there first and saved there afterwards
+    """
+    if cache is None:
+        return decode_img(fmt, assets_file, file_len)
+    blob = assets_file.read(file_len)
+    key = cache.key(fmt, blob)
+    file_dat = cache.get(key, "rgba")
+    if file_dat is None:
+        file_dat = decode_img(fmt, io.BytesIO(blob), file_len)
+        cache.put(key, "rgba", file_dat)
+    return file_dat
+
+def write_img_meta(out_meta_path, img_w, img_h, meta, raw_images):
+    # After the image dimensions there are 4 16-bit integers.
+    # I do not know what these represent, so I save them to a text file
+    # so they'll be around later when we build a new Assets.dat
+    with open(out_meta_path, "w") as meta_txt:
+        for meta_val in meta:
+            meta_txt.write("0x%x\n" % meta_val)
+        if raw_images:
+            meta_txt.write("%ux%u\n" % (img_w,img_h))
+
+def encode_png(img_w, img_h, bts):
+    """
+    returns the img_w*img_h RGBA data bts encoded as a png
+    """
+    from PIL import Image
+    out_png = io.BytesIO()
+    Image.frombytes("RGBA", (img_w, img_h), bts).save(out_png, "png")
+    return out_png.getvalue()
+
+def extract_img(assets_file, fmt, out_img_path, out_meta_path, raw_images, \
+                cache=None):
+    """
+    extract an image from assets_file.  The image will be saved in out_img_path
+    and the metadata (excluding the image resolution) will be saved as text to
+    out_meta_path.  assets_file's stream position should already point to the
+    beginning of the data (image width) before calling this function.  If
+    cache is a decode_cache the png is taken from there when it's already been
+    made once before.
+    """
+    img_w, img_h, meta, file_len = read_img_header(assets_file)
+    write_img_meta(out_meta_path, img_w, img_h, meta, raw_images)
+
+    if raw_images:
+        outfile = open(out_img_path, "wb")
+        copy_range(assets_file, assets_file.tell(), outfile, file_len)
+        outfile.close()
+    elif cache is not None:
+        blob = assets_file.read(file_len)
+        key = cache.key(fmt, blob, img_w, img_h)
+        png_dat = cache.get(key, "png")
+        if png_dat is None:
+            png_dat = encode_png(img_w, img_h, \
+                                 decode_img(fmt, io.BytesIO(blob), file_len))
+            cache.put(key, "png", png_dat)
+        with open(out_img_path, "wb") as outfile:
+            outfile.write(png_dat)
+    else:
+        from PIL import Image
+        file_dat = decode_img(fmt, assets_file, file_len)
+        out_img = Image.frombytes("RGBA", (img_w, img_h), file_dat)
+        out_img.save(out_img_path)
+
+def extract_text(assets_file, out_file_path):
+    """
+    extract a text file from assets_file.
+    out_file_path is the path to where the text should be saved.
+    assets_file should already be seek'd to the 4-byte length that
+    precede's the text.
+    """
+    file_len = struct.unpack("<I", assets_file.read(4))[0]
+    out_file = open(out_file_path,"wb")
+    copy_range(assets_file, assets_file.tell(), out_file, file_len)
+    out_file.close()
+
+def pack_glyph_header(metrics_data_map):
+    return GLYPH_HEADER.pack(int(metrics_data_map['charcode']),    \
+                             float(metrics_data_map['x1']),        \
+                             float(metrics_data_map['y1']),        \
+                             float(metrics_data_map['x2']),        \
+                             float(metrics_data_map['y2']),        \
+                             float(metrics_data_map['advance_x']), \
+                             float(metrics_data_map['advance_y']), \
+                             float(metrics_data_map['corner_x']),  \
+                             float(metrics_data_map['corner_y']),  \
+                             int(metrics_data_map['width']),       \
+                             int(metrics_data_map['height']))
+
+def write_glyph(assets_file, img_path, metrics_path):
+    with open(metrics_path, "r") as metrics_file:
+        metrics_data_map = json.loads(metrics_file.read())
+
+    assets_file.write(pack_glyph_header(metrics_data_map))
+
+    w = metrics_data_map['width']
+    h = metrics_data_map['height']
+
+    if w > 0 and h > 0:
+        from PIL import Image
+        img = Image.open(img_path)
+        assets_file.write(img.tobytes())
+
+def write_glyph_atlas(assets_file, cur_font_dir, glyph_count):
+    """
+    write glyph_count glyphs saved by extract_glyph_atlas to assets_file
+    """
+    from PIL import Image
+    with open(os.path.join(cur_font_dir, GLYPH_TABLE_NAME), "r") as table_file:
+        glyph_table = json.load(table_file)
+    sheet = Image.open(os.path.join(cur_font_dir, glyph_table['atlas']))
+    sheet = sheet.convert("L")
+
+    glyph_dat = bytearray()
+    for metrics_data_map in glyph_table['glyphs'][:glyph_count]:
+        glyph_dat += pack_glyph_header(metrics_data_map)
+        w = metrics_data_map['width']
+        h = metrics_data_map['height']
+        if w > 0 and h > 0:
+            x = metrics_data_map['x']
+            y = metrics_data_map['y']
+            glyph_dat += sheet.crop((x, y, x + w, y + h)).tobytes()
+    assets_file.write(glyph_dat)
+
+def write_font(assets_file, cur_font_dir):
+    with open(os.path.join(cur_font_dir, \
+                           "font_metrics.json"), "r") as font_meta_file:
+        metrics_data_map = json.loads(font_meta_file.read())
+    metrics_data_bin = FONT_HEADER.pack(int(metrics_data_map['size']),      \
+                                        int(metrics_data_map['flags']),     \
+                                        float(metrics_data_map['width']),   \
+                                        float(metrics_data_map['height']),  \
+                                        float(metrics_data_map['ascent']),  \
+                                        float(metrics_data_map['descent']), \
+                                        int(metrics_data_map['glyph_count']))
+    assets_file.write(metrics_data_bin)
+
+    if os.path.exists(os.path.join(cur_font_dir, GLYPH_TABLE_NAME)):
+        write_glyph_atlas(assets_file, cur_font_dir, \
+                          metrics_data_map['glyph_count'])
+        return
+
+    for glyph_no in range(metrics_data_map['glyph_count']):
+        metrics_path = os.path.join(cur_font_dir, \
+                                    "glyph_%d_metrics.json" % glyph_no)
+        img_path = os.path.join(cur_font_dir, "glyph_%d.png" % glyph_no)
+        write_glyph(assets_file, \
+                    metrics_path=metrics_path, img_path=img_path)
+
+def clear_transparent(img_w, img_h, bts):
+    """
+    returns a copy of the RGBA data bts where every pixel with an alpha of 0
+    is (0, 0, 0, 0).  Sprites are full of transparent pixels with whatever
+    color was left over in them, which looks the same in-game but gets in the
+    way of the compressor finding matches.  Returns a tuple of (new RGBA data,
+    number of pixels that were cleared), which doesn't count transparent
+    pixels that were already black.
+    """
+    from PIL import Image, ImageChops
+    if not bts:
+        return (bts, 0)
+    img = Image.frombytes("RGBA", (img_w, img_h), bts)
+    red, green, blue, alpha = img.split()
+    transparent = alpha.point(lambda val: 255 if val == 0 else 0)
+    colored = ImageChops.lighter(ImageChops.lighter(red, green), blue) \
+                        .point(lambda val: 255 if val else 0)
+    mask = ImageChops.darker(transparent, colored)
+    n_cleared = mask.histogram()[255]
+    if n_cleared:
+        img.paste((0, 0, 0, 0), mask=mask)
+    return (img.tobytes(), n_cleared)
+
+def compress_img_data(fmt, bts, name, quiet=False):
+    if fmt.image_format == 'zlib':
+        return zlib.compress(bts, 9)
+    if not quiet:
+        print("**** BEGIN COMPRESSION OF %s" % name)
+        print("    uncompressed length of %d" % len(bts))
+    return compress_img(bts, quiet=quiet)
+
+def write_img_entry(assets_file, fmt, img_w, img_h, meta, bts, name, \
+                    clear_alpha=False, verbose=False):
+    """
+    compress the RGBA data bts and write it to assets_file along with its
+    header.  meta is the list of the four mystery integers and name is only
+    used for progress messages.
+
+    If clear_alpha is True the color of every transparent pixel is cleared
+    first (see clear_transparent) and the compressed size and time are
+    printed.  If verbose is also True the original data is compressed too, to
+    show what clearing them gained.
+    """
+    if not clear_alpha:
+        data = compress_img_data(fmt, bts, name)
+    else:
+        cleared, n_cleared = clear_transparent(img_w, img_h, bts)
+        start = time.perf_counter()
+        data = compress_img_data(fmt, cleared, name)
+        elapsed = time.perf_counter() - start
+        ratio = len(data) / max(len(bts), 1)
+        print("%s: cleared %d transparent pixels, compressed to %d bytes " \
+              "(ratio %.3f) in %.1fms" % \
+              (name, n_cleared, len(data), ratio, elapsed * 1000))
+        if verbose and n_cleared:
+            start = time.perf_counter()
+            orig_len = len(compress_img_data(fmt, bts, name))
+            orig_elapsed = time.perf_counter() - start
+            print("%s: without clearing it's %d bytes (ratio %.3f) in " \
+                  "%.1fms; saved %d bytes and %.1fms" % \
+                  (name, orig_len, orig_len / max(len(bts), 1), \
+                   orig_elapsed * 1000, orig_len - len(data), \
+                   (orig_elapsed - elapsed) * 1000))
+    assets_file.write(IMG_HEADER.pack(img_w, img_h, meta[0], meta[1], \
+                                      meta[2], meta[3], len(data)))
+    assets_file.write(data)
+
+def write_img(assets_file, fmt, img_path, meta_path, clear_alpha=False, \
+              verbose=False):
+    from PIL import Image
+    img = Image.open(img_path, "r")
+    img_w, img_h = img.size
+    with open(meta_path, "r") as img_meta_file:
+        img_meta_txt = img_meta_file.read().splitlines()
+    meta = [int(img_meta_txt[i], 0) for i in range(4)]
+    write_img_entry(assets_file, fmt, img_w, img_h, meta, img.tobytes(), \
+                    img_path, clear_alpha=clear_alpha, verbose=verbose)
+
+def write_sound(assets_file, sound_path, meta_path):
+    with open(meta_path, "r") as sound_meta_file:
+        sound_meta_txt = sound_meta_file.read().splitlines()
+    sound_meta_data = struct.pack("BBBB",
+                                  int(sound_meta_txt[0], 0), \
+                                  int(sound_meta_txt[1], 0), \
+                                  int(sound_meta_txt[2], 0), \
+                                  int(sound_meta_txt[3], 0))
+    sound_file = open(sound_path, "rb")
+    sound_len = os.fstat(sound_file.fileno()).st_size
+
+    assets_file.write(sound_meta_data)
+    assets_file.write(struct.pack("<I", sound_len))
+    copy_range(sound_file, 0, assets_file, sound_len)
+    sound_file.close()
+
+def write_text(assets_file, text_file_path):
+    text_file = open(text_file_path, "rb")
+    text_len = os.fstat(text_file.fileno()).st_size
+    assets_file.write(struct.pack("<I", text_len))
+    copy_range(text_file, 0, assets_file, text_len)
+    text_file.close()
+
+def write_assets_file(assets_file_path, assets_dir_path, fmt, \
+                      clear_alpha=False, verbose=False):
+    """
+    build a new Assets.dat at assets_file_path out of the extracted assets
+    under assets_dir_path.  fmt is the assets_format to build for.  If the
+    images were extracted into atlases they're sliced back out of those.  If
+    clear_alpha is True the color of transparent pixels is cleared before
+    compressing each image (see clear_transparent).
+    """
+    paths = assets_paths(assets_dir_path)
+    assets_file = open(assets_file_path, "wb")
+
+    preload_file = open(paths.preload_file_path, "rb")
+    preload_data = preload_file.read()
+    preload_file.close()
+
+    assets_file.write(preload_data)
+    if assets_file.tell() != fmt.OFFSETS_START:
+        raise ValueError("preload_data has a length of %d (should be %d)" % \
+                         (len(preload_data), fmt.OFFSETS_START))
+
+    assets_file.seek(fmt.OFFSETS_START + fmt.offset_block_len(), os.SEEK_SET)
+
+    atlas = None
+    if has_atlas(paths.img_dir):
+        atlas = atlas_reader(paths.img_dir)
+
+    img_offsets = []
+    for img_idx in range(fmt.IMG_COUNT):
+        if verbose:
+            print("now saving image %d..." % img_idx)
+        img_offsets.append(assets_file.tell())
+
+        if atlas is not None:
+            img_w, img_h, meta, bts = atlas.get(img_idx)
+            write_img_entry(assets_file, fmt, img_w, img_h, meta, bts, \
+                            "atlas image %d" % img_idx, \
+                            clear_alpha=clear_alpha, verbose=verbose)
+            continue
+
+        write_img(assets_file, fmt, \
+                  img_path=os.path.join(paths.img_dir, \
+                                        "img_%d.png" % img_idx), \
+                  meta_path=os.path.join(paths.img_dir, \
+                                         "img_%d_meta.txt" % img_idx), \
+                  clear_alpha=clear_alpha, verbose=verbose)
+
+    sound_offsets = []
+    for sound_idx in range(fmt.SOUND_COUNT):
+        if verbose:
+            print("now saving sound %d..." % sound_idx)
+        sound_offsets.append(assets_file.tell())
+
+        sound_path = os.path.join(paths.audio_dir, "audio_%d.ogg" % sound_idx)
+        meta_path = os.path.join(paths.audio_dir, \
+                                 "audio_%d_meta.txt" % sound_idx)
+        write_sound(assets_file, sound_path=sound_path, meta_path=meta_path)
+
+    n_fonts = 0
+    if fmt.FONT_COUNT:
+        for file_name in os.listdir(paths.font_dir):
+            if re.match(r"font_\d", file_name):
+                n_fonts += 1
+
+    font_offsets = []
+    for font_idx in range(fmt.FONT_COUNT):
+        if verbose:
+            print("now saving font %d..." % font_idx)
+        font_offsets.append(assets_file.tell())
+
+        assets_file.write(struct.pack("<I", n_fonts))
+
+        for font_no in range(n_fonts):
+            cur_font_dir = os.path.join(paths.font_dir, "font_%d" % font_no)
+            write_font(assets_file, cur_font_dir=cur_font_dir)
+
+    shader_offsets = []
+    for shader_idx in range(fmt.SHADER_COUNT):
+        if verbose:
+            print("now saving shader %d..." % shader_idx)
+        shader_offsets.append(assets_file.tell())
+
+        vert_path = os.path.join(paths.shader_dir, \
+                                 "shader_%d_vert.glsl" % shader_idx)
+        frag_path = os.path.join(paths.shader_dir, \
+                                 "shader_%d_frag.glsl" % shader_idx)
+
+        write_text(assets_file, text_file_path=vert_path)
+        write_text(assets_file, text_file_path=frag_path)
+
+    file_offsets = []
+    for file_idx in range(fmt.FILE_COUNT):
+        if verbose:
+            print("now saving file %d..." % file_idx)
+        file_offsets.append(assets_file.tell())
+
+        file_path = os.path.join(paths.file_dir, "file_%d.txt" % file_idx)
+        write_text(assets_file, text_file_path=file_path)
+
+    # read in the type sizes
+    type_sizes = []
+    with open(paths.type_sizes_path, "r") as type_size_file:
+        type_size_txt = type_size_file.read().splitlines()
+    for i in range(fmt.TYPE_SIZE_COUNT):
+        if verbose:
+            print("now saving type size %d..." % i)
+        ts = int(type_size_txt[i], 0)
+        type_sizes.append(ts)
+
+    if verbose:
+        print("now writing metadata block...")
+    # now write the offsets block and the type sizes
+    assets_file.seek(fmt.OFFSETS_START, os.SEEK_SET)
+    for offset in (img_offsets + sound_offsets + font_offsets + \
+                   shader_offsets + file_offsets + type_sizes):
+        assets_file.write(struct.pack("<I", offset))
+    assets_file.close()
+
+def read_offset_table(assets_file, fmt):
+    """
+    read the metadata block at OFFSETS_START.  Returns a dict mapping each
+    asset class in ASSET_CLASSES to the list of offsets for that class, with
+    the type sizes stored under 'type_sizes'.
+    """
+    assets_file.seek(fmt.OFFSETS_START, os.SEEK_SET)
+    offset_table = {}
+    for asset_class, count_key in ASSET_CLASSES + TYPE_SIZE_CLASS:
+        count = getattr(fmt, count_key)
+        offset_table[asset_class] = \
+            list(struct.unpack("<%dI" % count, assets_file.read(4 * count)))
+    return offset_table
+
+class extract_journal:
+    """
+    keeps track of which assets extract_all_assets has finished so that an
+    interrupted extraction can pick up where it left off.  Each finished asset
+    is appended to the journal as "<class> <index>" right after its files are
+    closed, so anything in the journal was completely written.  The first line
+    records how images are being saved (png, bin or atlas) since a resumed
+    extraction has to keep doing it the same way.
+    """
+    def __init__(self, journal_path, img_mode):
+        self.journal_path = journal_path
+        self.done = set()
+        self.lock = threading.Lock()
+        if os.path.exists(journal_path):
+            with open(journal_path, "r") as journal_file:
+                lines = journal_file.read().splitlines()
+            if not lines or lines[0] != "mode %s" % img_mode:
+                raise ValueError("%s was started with different options (%s)" % \
+                                 (journal_path, lines[:1]))
+            for line in lines[1:]:
+                fields = line.split()
+                # the last line might be cut off if we got killed while
+                # writing it
+                if len(fields) == 2 and fields[1].isdigit():
+                    self.done.add((fields[0], int(fields[1])))
+            self.journal_file = open(journal_path, "a")
+        else:
+            self.journal_file = open(journal_path, "w")
+            self.journal_file.write("mode %s\n" % img_mode)
+            self.journal_file.flush()
+
+    def is_done(self, asset_class, index):
+        return (asset_class, index) in self.done
+
+    def mark_done(self, asset_class, index):
+        with self.lock:
+            self.journal_file.write("%s %d\n" % (asset_class, index))
+            self.journal_file.flush()
+            self.done.add((asset_class, index))
+
+    def finish(self):
+        """
+        close the journal and delete it, once everything has been extracted
+        """
+        self.journal_file.close()
+        os.remove(self.journal_path)
+
+def file_has_len(path, length=None):
+    """
+    returns True if path exists and is length bytes long (or isn't empty, if
+    length is None)
+    """
+    try:
+        file_len = os.path.getsize(path)
+    except OSError:
+        return False
+    if length is None:
+        return file_len > 0
+    return file_len == length
+
+class img_job:
+    """
+    one image on its way through extract_images_pipelined
+    """
+    def __init__(self, index, img_w, img_h, meta, blob):
+        self.index = index
+        self.img_w = img_w
+        self.img_h = img_h
+        self.meta = meta
+        self.blob = blob
+        self.bts = None
+        self.png = None
+
+def decode_blob(fmt, blob):
+    return decode_img(fmt, io.BytesIO(blob), len(blob))
+
+def extract_images_pipelined(archive, img_dir, img_mode, journal, \
+                             cache=None, decode_jobs=None, write_jobs=None):
+    """
+    extract every image in archive (an assets_archive) into img_dir with a
+    pipeline (see fppipeline.py).  This thread slices the compressed images
+    out of the archive, a pool of decode_jobs threads decodes them and
+    another write_jobs threads encode and save the pngs; both default to the
+    number of CPUs.  Chowdren images are decoded in python, so for those each
+    decode thread hands its image off to a pool of decode_jobs processes
+    instead.  img_mode is png, bin or atlas, same as in the journal.
+    Atlases are still packed in index order by a single thread.
+    """
+    fmt = archive.fmt
+    if decode_jobs is None:
+        decode_jobs = os.cpu_count() or 1
+    if write_jobs is None:
+        write_jobs = os.cpu_count() or 1
+    pool = None
+    if img_mode != "bin" and fmt.image_format == 'chowdren':
+        pool = ProcessPoolExecutor(decode_jobs)
+
+    if img_mode == "bin":
+        img_ext = "bin"
+    else:
+        img_ext = "png"
+
+    def img_paths(index):
+        return (os.path.join(img_dir, "img_%d.%s" % (index, img_ext)), \
+                os.path.join(img_dir, "img_%d_meta.txt" % index))
+
+    def read_stage():
+        for index in range(archive.count('img')):
+            if img_mode != "atlas":
+                img_path, meta_path = img_paths(index)
+                if journal.is_done('img', index) and \
+                   file_has_len(img_path) and file_has_len(meta_path):
+                    continue
+            print("preparing to extract image %d..." % index)
+            img_w, img_h, meta, file_len = archive.img_header(index)
+            yield img_job(index, img_w, img_h, meta, \
+                          bytes(archive.img_blob(index)))
+
+    def decode_stage(job):
+        if img_mode == "bin":
+            return job
+        key = None
+        if cache is not None:
+            if img_mode == "png":
+                job.png = cache.get(cache.key(fmt, job.blob, job.img_w, \
+                                              job.img_h), "png")
+                if job.png is not None:
+                    return job
+            else:
+                key = cache.key(fmt, job.blob)
+                job.bts = cache.get(key, "rgba")
+                if job.bts is not None:
+                    return job
+        if pool is None:
+            job.bts = decode_blob(fmt, job.blob)
+        else:
+            job.bts = pool.submit(decode_blob, fmt, job.blob).result()
+        if key is not None:
+            cache.put(key, "rgba", job.bts)
+        return job
+
+    def write_stage(job):
+        img_path, meta_path = img_paths(job.index)
+        write_img_meta(meta_path, job.img_w, job.img_h, job.meta, \
+                       img_mode == "bin")
+        if img_mode == "bin":
+            out_dat = job.blob
+        else:
+            if job.png is None:
+                job.png = encode_png(job.img_w, job.img_h, job.bts)
+                if cache is not None:
+                    cache.put(cache.key(fmt, job.blob, job.img_w, \
+                                        job.img_h), "png", job.png)
+            out_dat = job.png
+        with open(img_path, "wb") as outfile:
+            outfile.write(out_dat)
+        journal.mark_done('img', job.index)
+
+    if img_mode == "atlas":
+        img_atlas = atlas_writer(img_dir)
+        # images come out of the decode threads in whatever order they
+        # finish in, but they have to be packed in index order
+        pending = {}
+        next_index = [0]
+        def atlas_stage(job):
+            pending[job.index] = job
+            while next_index[0] in pending:
+                job = pending.pop(next_index[0])
+                img_atlas.add(job.index, job.img_w, job.img_h, job.meta, \
+                              job.bts)
+                next_index[0] += 1
+        stages = [(decode_stage, decode_jobs), (atlas_stage, 1)]
+    else:
+        stages = [(decode_stage, decode_jobs), (write_stage, write_jobs)]
+
+    try:
+        run_pipeline(read_stage(), stages)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    if img_mode == "atlas":
+        img_atlas.close()
+
+def extract_all_assets(assets_file_path, assets_dir_path, fmt, \
+                       raw_images=False, atlas=False, resume=False, \
+                       cache=None, pipeline=False, decode_jobs=None, \
+                       write_jobs=None, verbose=False):
+    """
+    extract everything in the Assets.dat at assets_file_path to a new
+    directory at assets_dir_path.  fmt is the assets_format describing the
+    file.  If raw_images is True images are saved exactly as they are stored
+    instead of being decoded to png.  If atlas is True the decoded images are
+    packed into a few big atlas sheets instead of one png each (see
+    fpatlas.py).
+
+    Progress is kept in an extract_journal in assets_dir_path until the
+    extraction finishes.  If resume is True and assets_dir_path is left over
+    from an extraction that got interrupted, every asset in the journal whose
+    files still look right is skipped and everything else is extracted again.
+    Atlases and fonts are always redone, since they're only saved at the end.
+
+    cache is an optional decode_cache (see fpcache.py) which decoded images
+    are shared through between extractions.
+
+    If pipeline is True images are read, decoded and saved all at the same
+    time with decode_jobs threads (or processes) decoding and write_jobs
+    threads saving, see extract_images_pipelined.
+    """
+    paths = assets_paths(assets_dir_path)
+    if raw_images and atlas:
+        raise ValueError("raw images can't be packed into an atlas")
+    if raw_images:
+        img_mode = "bin"
+    elif atlas:
+        img_mode = "atlas"
+    else:
+        img_mode = "png"
+
+    if os.path.exists(assets_dir_path):
+        if not resume:
+            raise FileExistsError("\"%s\" already exists" % assets_dir_path)
+        if not os.path.exists(paths.journal_path) and \
+           len(os.listdir(assets_dir_path)):
+            if os.path.exists(paths.format_path):
+                # it already finished
+                return
+            raise FileExistsError("\"%s\" already exists and is not an interrupted extraction" % assets_dir_path)
+
+    assets_file = open(assets_file_path, "rb")
+
+    os.makedirs(assets_dir_path, 0o755, exist_ok=True)
+    journal = extract_journal(paths.journal_path, img_mode)
+    os.makedirs(paths.img_dir, 0o755, exist_ok=True)
+    os.makedirs(paths.audio_dir, 0o755, exist_ok=True)
+    os.makedirs(paths.shader_dir, 0o755, exist_ok=True)
+    os.makedirs(paths.file_dir, 0o755, exist_ok=True)
+    os.makedirs(paths.font_dir, 0o755, exist_ok=True)
+
+    # read in the preload data.  This doesn't seem to serve any purpose in
+    # Freedom Planet and you can actually zero it out without consequence.
+    # This script dumps it anyways and re-inserts it verbatim when the new
+    # Assets.dat just in case I'm wrong.  At any rate, this keeps binary
+    # patches small.
+    preload_data = assets_file.read(fmt.OFFSETS_START)
+    with open(paths.preload_file_path, "wb") as preload_data_file:
+        preload_data_file.write(preload_data)
+
+    offset_table = read_offset_table(assets_file, fmt)
+    img_offsets = offset_table['img']
+    sound_offsets = offset_table['sound']
+    font_offsets = offset_table['font']
+    shader_offsets = offset_table['shader']
+    file_offsets = offset_table['file']
+    type_sizes = offset_table['type_sizes']
+
+    # write the type sizes
+    with open(paths.type_sizes_path, "w") as type_size_file:
+        for ts in type_sizes:
+            type_size_file.write("0x%x\n" % ts)
+
+    if pipeline:
+        archive = assets_archive(assets_file_path, fmt)
+        try:
+            extract_images_pipelined(archive, paths.img_dir, img_mode, \
+                                     journal, cache=cache, \
+                                     decode_jobs=decode_jobs, \
+                                     write_jobs=write_jobs)
+        finally:
+            archive.close()
+    else:
+        if raw_images:
+            img_ext = "bin"
+        else:
+            img_ext = "png"
+        if atlas:
+            img_atlas = atlas_writer(paths.img_dir)
+        for index, offset in enumerate(img_offsets):
+            if atlas:
+                print("preparing to extract image %d..." % index)
+                assets_file.seek(offset)
+                img_w, img_h, meta, file_len = read_img_header(assets_file)
+                img_atlas.add(index, img_w, img_h, meta, \
+                              decode_img_cached(fmt, assets_file, file_len, \
+                                                cache))
+                continue
+
+            img_path = os.path.join(paths.img_dir, "img_%d.%s" % (index, img_ext))
+            meta_path = os.path.join(paths.img_dir, "img_%d_meta.txt" % index)
+            if journal.is_done('img', index) and file_has_len(img_path) and \
+               file_has_len(meta_path):
+                continue
+            print("preparing to extract image %d..." % index)
+            assets_file.seek(offset)
+            extract_img(assets_file, fmt, img_path, meta_path, raw_images, \
+                        cache)
+            journal.mark_done('img', index)
+        if atlas:
+            img_atlas.close()
+
+    for index, offset in enumerate(sound_offsets):
+        assets_file.seek(offset)
+
+        # Here there are 4 unknown bytes followed by a 4-byte length and then
+        # an ogg file
+        meta_dat = assets_file.read(4)
+        file_len = struct.unpack("<I", assets_file.read(4))[0]
+
+        sound_path = os.path.join(paths.audio_dir, "audio_%d.ogg" % index)
+        meta_path = os.path.join(paths.audio_dir, "audio_%d_meta.txt" % index)
+        if journal.is_done('sound', index) and \
+           file_has_len(sound_path, file_len) and file_has_len(meta_path):
+            continue
+
+        with open(meta_path, "w") as meta_txt:
+            for meta_val in meta_dat:
+                meta_txt.write("0x%x\n" % meta_val)
+
+        out_file = open(sound_path, "wb")
+        copy_range(assets_file, assets_file.tell(), out_file, file_len)
+        out_file.close()
+        journal.mark_done('sound', index)
+
+    # next read in fonts
+    for index, offset in enumerate(font_offsets):
+        assets_file.seek(offset)
+
+        n_fonts = struct.unpack("<I", assets_file.read(4))[0]
+
+        for font_no in range(n_fonts):
+            cur_font_dir = os.path.join(paths.font_dir, "font_%d" % font_no)
+            if os.path.exists(cur_font_dir):
+                shutil.rmtree(cur_font_dir)
+            extract_font(assets_file, cur_font_dir, atlas=atlas)
+
+    # next read in shaders.  These are just 4-byte lengths followed by text
+    for index, offset in enumerate(shader_offsets):
+        vert_path = os.path.join(paths.shader_dir, \
+                                 "shader_%d_vert.glsl" % index)
+        frag_path = os.path.join(paths.shader_dir, \
+                                 "shader_%d_frag.glsl" % index)
+        if journal.is_done('shader', index):
+            assets_file.seek(offset)
+            vert_len = struct.unpack("<I", assets_file.read(4))[0]
+            assets_file.seek(offset + 4 + vert_len)
+            frag_len = struct.unpack("<I", assets_file.read(4))[0]
+            if file_has_len(vert_path, vert_len) and \
+               file_has_len(frag_path, frag_len):
+                continue
+
+        assets_file.seek(offset)
+        extract_text(assets_file, vert_path)
+        extract_text(assets_file, frag_path)
+        journal.mark_done('shader', index)
+
+    # next read in files.  These are just 4-byte lengths followed by text.
+    for index, offset in enumerate(file_offsets):
+        file_path = os.path.join(paths.file_dir, "file_%d.txt" % index)
+        assets_file.seek(offset)
+        if journal.is_done('file', index):
+            text_len = struct.unpack("<I", assets_file.read(4))[0]
+            if file_has_len(file_path, text_len):
+                continue
+            assets_file.seek(offset)
+
+        extract_text(assets_file, file_path)
+        journal.mark_done('file', index)
+
+    assets_file.close()
+
+    # save metadata so we have it on hand when we create a new Assets.dat
+    with open(paths.format_path, "w") as fmt_file:
+        json.dump(fmt.to_json(), fmt_file, indent=4)
+    journal.finish()
+
+def entry_extents(assets_file, fmt, offset_table):
+    """
+    figure out where each asset listed in offset_table begins and ends.  The
+    archive doesn't store lengths, so every entry is assumed to run until the
+    next one starts (or until the end of the file).  Returns a dict mapping
+    each class in ASSET_CLASSES to a list of (offset, length) tuples.
+
+    This raises ValueError if the entries don't tile the archive from the end
+    of the metadata block to the end of the file, since then they can't be
+    used to reproduce it.
+    """
+    assets_file.seek(0, os.SEEK_END)
+    file_len = assets_file.tell()
+    data_start = fmt.OFFSETS_START + fmt.offset_block_len()
+
+    all_offsets = set()
+    for asset_class, count_key in ASSET_CLASSES:
+        all_offsets.update(offset_table[asset_class])
+    all_offsets = sorted(all_offsets)
+
+    if all_offsets:
+        first_offset = all_offsets[0]
+    else:
+        first_offset = file_len
+    if first_offset != data_start or file_len < data_start:
+        raise ValueError("assets in %s do not begin immediately after the metadata block" % assets_file.name)
+
+    entry_ends = dict(zip(all_offsets, all_offsets[1:] + [file_len]))
+    extents = {}
+    for asset_class, count_key in ASSET_CLASSES:
+        extents[asset_class] = [(offset, entry_ends[offset] - offset) \
+                                for offset in offset_table[asset_class]]
+    return extents
+
+def hash_range(assets_file, offset, length):
+    """
+    returns the md5 digest of length bytes starting at offset in assets_file.
+    """
+    hasher = hashlib.md5()
+    assets_file.seek(offset, os.SEEK_SET)
+    while length > 0:
+        buf = assets_file.read(min(COPY_CHUNK_SIZE, length))
+        if not buf:
+            break
+        hasher.update(buf)
+        length -= len(buf)
+    return hasher.digest()
+
+def hash_entries(assets_file, extents):
+    """
+    hash every entry in extents as-is, without decoding anything.  Entries are
+    read in the order they're stored so this is one sequential pass over the
+    file.  Returns a dict with the same layout as extents holding the digests.
+    """
+    hashes = {}
+    pending = []
+    for asset_class, count_key in ASSET_CLASSES:
+        hashes[asset_class] = [None] * len(extents[asset_class])
+        for index, extent in enumerate(extents[asset_class]):
+            pending.append((extent, asset_class, index))
+    pending.sort()
+
+    for (offset, length), asset_class, index in pending:
+        hashes[asset_class][index] = hash_range(assets_file, offset, length)
+    return hashes
+
+class assets_archive:
+    """
+    an Assets.dat opened for random access to individual entries.  The whole
+    file is mmap'd and reading an entry never touches a file position, so one
+    of these can be shared between threads.
+    """
+    def __init__(self, assets_file_path, fmt):
+        self.path = assets_file_path
+        self.fmt = fmt
+        self.file = open(assets_file_path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.offset_table = read_offset_table(self.file, fmt)
+        self.extents = entry_extents(self.file, fmt, self.offset_table)
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def count(self, asset_class):
+        return len(self.extents[asset_class])
+
+    def entry(self, asset_class, index):
+        """
+        returns all of the bytes of entry number index of asset_class, exactly
+        as they're stored.  Raises IndexError if there's no such entry.
+        """
+        offset, length = self.extents[asset_class][index]
+        return self.data[offset:offset + length]
+
+    def entry_hash(self, asset_class, index):
+        """
+        md5 of the stored bytes of an entry; this changes whenever the entry
+        does without having to decode anything.
+        """
+        return hashlib.md5(self.entry(asset_class, index)).hexdigest()
+
+    def img_header(self, index):
+        """
+        returns the (width, height, meta, compressed length) of image index
+        """
+        offset = self.extents['img'][index][0]
+        return read_img_header(io.BytesIO(self.data[offset:offset + \
+                                                    IMG_HEADER.size]))
+
+    def img_blob(self, index):
+        """
+        returns the compressed data of image index
+        """
+        offset = self.extents['img'][index][0] + IMG_HEADER.size
+        img_w, img_h, meta, file_len = self.img_header(index)
+        return self.data[offset:offset + file_len]
+
+    def decode_img(self, index):
+        """
+        returns a tuple of (width, height, RGBA data) for image index
+        """
+        img_w, img_h, meta, file_len = self.img_header(index)
+        return (img_w, img_h, \
+                decode_img(self.fmt, io.BytesIO(self.img_blob(index)), \
+                           file_len))
+
+    def decode_rows(self, index, first_row=0, last_row=None):
+        """
+        decode only rows first_row through last_row (exclusive, or the bottom
+        of the image if it's None) of image index.  Returns a tuple of (width,
+        number of rows, RGBA data).
+        """
+        img_w, img_h, meta, file_len = self.img_header(index)
+        if last_row is None or last_row > img_h:
+            last_row = img_h
+        first_row = min(first_row, last_row)
+        row_len = img_w * 4
+        return (img_w, last_row - first_row, \
+                decode_img_range(self.fmt, self.img_blob(index), \
+                                 first_row * row_len, last_row * row_len))
+
+    def img_thumbnail(self, index, size=THUMBNAIL_SIZE, max_rows=None):
+        """
+        returns a png of image index scaled down to fit in a size*size box.
+        If max_rows is given only that many rows from the top are decoded,
+        which is a lot quicker for tall images.
+        """
+        from PIL import Image
+        img_w, n_rows, bts = self.decode_rows(index, 0, max_rows)
+        out = io.BytesIO()
+        if img_w == 0 or n_rows == 0:
+            img = Image.new("RGBA", (1, 1), (0, 0, 0, 0))
+        else:
+            img = Image.frombytes("RGBA", (img_w, n_rows), bts)
+            img.thumbnail((size, size))
+        img.save(out, "png")
+        return out.getvalue()
+
+    def read_text(self, offset):
+        text_len = struct.unpack("<I", self.data[offset:offset + 4])[0]
+        return self.data[offset + 4:offset + 4 + text_len]
+
+    def sound(self, index):
+        """
+        returns a tuple of (meta, ogg data) for sound index
+        """
+        offset = self.extents['sound'][index][0]
+        return (list(self.data[offset:offset + 4]), \
+                self.read_text(offset + 4))
+
+    def shader(self, index):
+        """
+        returns a tuple of the (vertex, fragment) source of shader index
+        """
+        offset = self.extents['shader'][index][0]
+        vert = self.read_text(offset)
+        return (vert, self.read_text(offset + 4 + len(vert)))
+
+    def text_file(self, index):
+        return self.read_text(self.extents['file'][index][0])
+
+def archive_stamp(assets_file_path):
+    """
+    returns [size, modification time in ns] of the file at assets_file_path,
+    which changes whenever the archive is replaced or modified
+    """
+    stat = os.stat(assets_file_path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+# how many images each worker process of map_images is handed at a time
+IMG_CHUNK_SIZE = 64
+
+# the archive each worker process of map_images has open.  It's only ever set
+# inside those processes.
+worker_archive = None
+
+def open_worker_archive(assets_file_path, fmt_json):
+    global worker_archive
+    worker_archive = assets_archive(assets_file_path, assets_format(fmt_json))
+
+def map_image_chunk(func, indices, args):
+    return [func(worker_archive, index, *args) for index in indices]
+
+def map_images(assets_file_path, fmt, func, args=(), n_jobs=None):
+    """
+    call func(archive, index, *args) for every image in the Assets.dat at
+    assets_file_path (described by the assets_format fmt) on a pool of n_jobs
+    worker processes, each of which opens its own assets_archive.  func has
+    to be a module-level function so it can be pickled.  Returns a list of
+    what it returned, in index order.
+    """
+    chunks = [range(start, min(start + IMG_CHUNK_SIZE, fmt.IMG_COUNT)) \
+              for start in range(0, fmt.IMG_COUNT, IMG_CHUNK_SIZE)]
+    results = []
+    with ProcessPoolExecutor(n_jobs, initializer=open_worker_archive, \
+                             initargs=(assets_file_path, \
+                                       fmt.to_json())) as pool:
+        for chunk_results in pool.map(map_image_chunk, [func] * len(chunks), \
+                                      chunks, [args] * len(chunks)):
+            results.extend(chunk_results)
+    return results
+
+def replace_entry(archive, asset_class, index, entry, out_path):
+    """
+    save a copy of archive (an assets_archive) to out_path with entry number
+    index of asset_class replaced by entry, which is all of the bytes of the
+    new entry as it's stored (e.g. for an image, its header and compressed
+    data).  Everything else is copied and every later offset is moved over.
+    Entries which share the old entry's offset end up sharing the new one.
+    """
+    if os.path.abspath(out_path) == os.path.abspath(archive.path):
+        raise ValueError("can't replace an entry in place, out_path has to be a different file")
+    old_offset, old_len = archive.extents[asset_class][index]
+    delta = len(entry) - old_len
+    end_offset = old_offset + old_len
+    with open(archive.path, "rb") as src_file, open(out_path, "wb") as out_file:
+        copy_range(src_file, 0, out_file, old_offset)
+        out_file.write(entry)
+        copy_range(src_file, end_offset, out_file, \
+                   len(archive.data) - end_offset)
+
+        out_file.seek(archive.fmt.OFFSETS_START, os.SEEK_SET)
+        for cls, count_key in ASSET_CLASSES:
+            for offset in archive.offset_table[cls]:
+                if offset > old_offset:
+                    offset += delta
+                out_file.write(struct.pack("<I", offset))
+
+def diff_assets(base_path, base_fmt, new_path, new_fmt, patch_path, \
+                verbose=False):
+    """
+    compare the Assets.dat at new_path against the one at base_path entry by
+    entry and save a patch to patch_path which contains only the entries of
+    new_path that can't be found anywhere in base_path.  Entries are compared
+    by hashing their compressed data, so nothing gets decoded.
+
+    A patch is PATCH_MAGIC followed by a 4-byte little-endian header length,
+    a json header and then the data for every changed entry.  The header lists
+    the ops for each asset class in order; an op is either
+    ["base", first_index, count] to copy a run of entries from the base
+    archive or ["data", offset, length] to copy one entry out of the patch
+    (offset being relative to the end of the header).
+
+    Entries which share an offset in new_path share it in the patched file
+    too.  ValueError is raised if new_path doesn't store its entries in the
+    order they're listed in, since apply_patch couldn't reproduce it.
+
+    Returns a tuple of how many entries changed and how many there are.
+    """
+    base_file = open(base_path, "rb")
+    new_file = open(new_path, "rb")
+
+    base_table = read_offset_table(base_file, base_fmt)
+    new_table = read_offset_table(new_file, new_fmt)
+    base_extents = entry_extents(base_file, base_fmt, base_table)
+    new_extents = entry_extents(new_file, new_fmt, new_table)
+
+    # apply_patch writes each entry the first time it's listed, so that has
+    # to be the order they're stored in
+    seen_offsets = set()
+    last_offset = -1
+    for asset_class, count_key in ASSET_CLASSES:
+        for offset, length in new_extents[asset_class]:
+            if offset in seen_offsets:
+                continue
+            if offset < last_offset:
+                raise ValueError("entries in %s aren't stored in the order they're listed in, so it can't be patched" % new_path)
+            seen_offsets.add(offset)
+            last_offset = offset
+
+    if verbose:
+        print("hashing %s..." % base_path)
+    base_hashes = hash_entries(base_file, base_extents)
+    if verbose:
+        print("hashing %s..." % new_path)
+    new_hashes = hash_entries(new_file, new_extents)
+
+    # extents in new_file that need to be saved in the patch
+    patch_data = []
+    patch_len = 0
+
+    header = {}
+    header['base_format'] = base_fmt.to_json()
+    header['format'] = new_fmt.to_json()
+    header['base_md5'] = md5sum(base_path)
+    header['md5'] = md5sum(new_path)
+    header['type_sizes'] = new_table['type_sizes']
+
+    base_file.seek(0, os.SEEK_SET)
+    base_preload = base_file.read(base_fmt.OFFSETS_START)
+    new_file.seek(0, os.SEEK_SET)
+    new_preload = new_file.read(new_fmt.OFFSETS_START)
+    if base_preload == new_preload:
+        header['preload'] = None
+    else:
+        header['preload'] = [patch_len, len(new_preload)]
+        patch_data.append((0, len(new_preload)))
+        patch_len += len(new_preload)
+
+    n_changed = 0
+    n_entries = 0
+    header['ops'] = {}
+
+    # apply_patch only copies each base offset and each piece of patch data
+    # once; every later op that uses it again gets the same offset in the
+    # output.  So entries which share an offset in new_file have to use the
+    # same source, and entries which don't can't.
+    used_base_offsets = set()
+    for asset_class, count_key in ASSET_CLASSES:
+        # indices of every copy of each distinct entry in the base archive
+        base_index = {}
+        for index, digest in enumerate(base_hashes[asset_class]):
+            base_index.setdefault(digest, []).append(index)
+        base_count = len(base_hashes[asset_class])
+
+        # source of every offset in new_file seen so far in this class,
+        # either ("base", index) or ("data", offset in the patch)
+        new_sources = {}
+
+        ops = []
+        for index, digest in enumerate(new_hashes[asset_class]):
+            n_entries += 1
+            offset, length = new_extents[asset_class][index]
+            source = new_sources.get(offset)
+            if source is None:
+                candidates = base_index.get(digest, [])
+                if index < base_count and \
+                   base_hashes[asset_class][index] == digest:
+                    candidates = [index] + candidates
+                for src_index in candidates:
+                    src_offset = base_extents[asset_class][src_index][0]
+                    if src_offset not in used_base_offsets:
+                        used_base_offsets.add(src_offset)
+                        source = ("base", src_index)
+                        break
+                else:
+                    source = ("data", patch_len)
+                    patch_data.append((offset, length))
+                    patch_len += length
+                new_sources[offset] = source
+
+            if source[0] == "data":
+                ops.append(["data", source[1], length])
+                n_changed += 1
+            elif len(ops) and ops[-1][0] == "base" and \
+                 ops[-1][1] + ops[-1][2] == source[1]:
+                ops[-1][2] += 1
+            else:
+                ops.append(["base", source[1], 1])
+        header['ops'][asset_class] = ops
+
+    header_dat = json.dumps(header).encode("utf-8")
+    patch_file = open(patch_path, "wb")
+    patch_file.write(PATCH_MAGIC)
+    patch_file.write(struct.pack("<I", len(header_dat)))
+    patch_file.write(header_dat)
+    for offset, length in patch_data:
+        copy_range(new_file, offset, patch_file, length)
+    patch_file.close()
+    base_file.close()
+    new_file.close()
+
+    return (n_changed, n_entries)
+
+def apply_patch(base_path, patch_path, out_path, verbose=False):
+    """
+    rebuild the Assets.dat that patch_path was made from by diff_assets,
+    streaming every unchanged entry out of base_path.  The result is saved to
+    out_path and checked against the md5sum recorded in the patch, which is
+    returned.  ValueError is raised if anything doesn't match.
+    """
+    patch_file = open(patch_path, "rb")
+    if patch_file.read(len(PATCH_MAGIC)) != PATCH_MAGIC:
+        raise ValueError("%s is not an fp-assets patch" % patch_path)
+    header_len = struct.unpack("<I", patch_file.read(4))[0]
+    header = json.loads(patch_file.read(header_len).decode("utf-8"))
+    data_start = patch_file.tell()
+
+    base_csum = md5sum(base_path)
+    if base_csum != header['base_md5']:
+        raise ValueError("patch was made against an assets file with md5sum %s, but %s has md5sum %s" % (header['base_md5'], base_path, base_csum))
+
+    base_fmt = assets_format(header['base_format'])
+    fmt = assets_format(header['format'])
+    base_file = open(base_path, "rb")
+    base_extents = entry_extents(base_file, base_fmt, \
+                                 read_offset_table(base_file, base_fmt))
+
+    out_file = open(out_path, "wb")
+    if header['preload'] is None:
+        copy_range(base_file, 0, out_file, base_fmt.OFFSETS_START)
+    else:
+        offset, length = header['preload']
+        copy_range(patch_file, data_start + offset, out_file, length)
+
+    if out_file.tell() != fmt.OFFSETS_START:
+        raise ValueError("preload_data has a length of %d (should be %d)" % \
+                         (out_file.tell(), fmt.OFFSETS_START))
+
+    out_file.seek(fmt.OFFSETS_START + fmt.offset_block_len(), os.SEEK_SET)
+
+    offsets = []
+    # offset in out_file of everything copied so far, by where it came from.
+    # Entries which share an offset (see diff_assets) are only copied once.
+    written = {}
+    for asset_class, count_key in ASSET_CLASSES:
+        if verbose:
+            print("now patching %s entries..." % asset_class)
+        for op in header['ops'][asset_class]:
+            if op[0] == "data":
+                key = ("data", op[1])
+                if key not in written:
+                    written[key] = out_file.tell()
+                    copy_range(patch_file, data_start + op[1], out_file, op[2])
+                offsets.append(written[key])
+                continue
+
+            # runs of unchanged entries are almost always stored back to
+            # back in the base archive, so copy as much as possible in one go
+            run_start = None
+            run_end = None
+            for offset, length in base_extents[asset_class][op[1]:op[1] + op[2]]:
+                key = ("base", offset)
+                if key in written:
+                    offsets.append(written[key])
+                    continue
+                if offset != run_end:
+                    if run_start is not None:
+                        copy_range(base_file, run_start, out_file, \
+                                   run_end - run_start)
+                    run_start = offset
+                    run_end = offset
+                written[key] = out_file.tell() + run_end - run_start
+                offsets.append(written[key])
+                run_end += length
+            if run_start is not None:
+                copy_range(base_file, run_start, out_file, \
+                           run_end - run_start)
+
+    out_file.seek(fmt.OFFSETS_START, os.SEEK_SET)
+    for offset in offsets + header['type_sizes']:
+        out_file.write(struct.pack("<I", offset))
+    out_file.close()
+    patch_file.close()
+    base_file.close()
+
+    out_csum = md5sum(out_path)
+    if out_csum != header['md5']:
+        raise ValueError("patched assets file has md5sum %s but should have %s" % (out_csum, header['md5']))
+    return out_csum
+
+# how much compressed data scan_zlib_img feeds to zlib at a time
+SCAN_CHUNK_SIZE = 64 * 1024
+
+def scan_zlib_img(dat, expect_len):
+    """
+    returns a list of everything wrong with the zlib-compressed image dat,
+    which should decompress to expect_len bytes.  The output is thrown away
+    as it's decompressed instead of being kept around.
+    """
+    decomp = zlib.decompressobj()
+    decoded_len = 0
+    try:
+        for pos in range(0, len(dat), SCAN_CHUNK_SIZE):
+            chunk = dat[pos:pos + SCAN_CHUNK_SIZE]
+            while chunk:
+                decoded_len += len(decomp.decompress(chunk, SCAN_CHUNK_SIZE))
+                chunk = decomp.unconsumed_tail
+        decoded_len += len(decomp.flush())
+    except zlib.error as err:
+        return ["zlib error: %s" % err]
+    errors = []
+    if not decomp.eof:
+        errors.append("zlib stream is cut off")
+    elif decomp.unused_data:
+        errors.append("%d extra bytes after the end of the zlib stream" % \
+                      len(decomp.unused_data))
+    if decoded_len != expect_len:
+        errors.append("decodes to %d bytes but should be %d" % \
+                      (decoded_len, expect_len))
+    return errors
+
+def scan_text(data, offset, what, errors):
+    """
+    check the 4-byte length and text at offset.  Returns the offset right
+    after it, or None if it runs past the end of the file.
+    """
+    if offset + 4 > len(data):
+        errors.append("%s: length at offset %d is past the end of the file" % \
+                      (what, offset))
+        return None
+    text_len = struct.unpack_from("<I", data, offset)[0]
+    if offset + 4 + text_len > len(data):
+        errors.append("%s: %d bytes long but only %d bytes are left in the file" % \
+                      (what, text_len, len(data) - offset - 4))
+        return None
+    return offset + 4 + text_len
+
+def scan_font_entry(data, offset, what, errors):
+    """
+    check every font and glyph in the font entry at offset against the length
+    of the file
+    """
+    if offset + 4 > len(data):
+        errors.append("%s: past the end of the file" % what)
+        return
+    n_fonts = struct.unpack_from("<I", data, offset)[0]
+    offset += 4
+    for font_no in range(n_fonts):
+        if offset + FONT_HEADER.size > len(data):
+            errors.append("%s: font %d header is past the end of the file" % \
+                          (what, font_no))
+            return
+        font_metrics = dict(zip(FONT_FIELDS, \
+                                FONT_HEADER.unpack_from(data, offset)))
+        offset += FONT_HEADER.size
+        for glyph_no in range(font_metrics['glyph_count']):
+            if offset + GLYPH_HEADER.size > len(data):
+                errors.append("%s: font %d glyph %d header is past the end of the file" % \
+                              (what, font_no, glyph_no))
+                return
+            metrics = dict(zip(GLYPH_FIELDS, \
+                               GLYPH_HEADER.unpack_from(data, offset)))
+            offset += GLYPH_HEADER.size
+            if metrics['width'] > 0 and metrics['height'] > 0:
+                offset += metrics['width'] * metrics['height']
+            if offset > len(data):
+                errors.append("%s: font %d glyph %d runs past the end of the file" % \
+                              (what, font_no, glyph_no))
+                return
+
+def scan_assets(assets_file_path, fmt, verbose=False):
+    """
+    check that every entry in the Assets.dat at assets_file_path (described by
+    the assets_format fmt) is well-formed without extracting anything.  Images
+    get the same checks load_hunk makes (or are run through zlib and thrown
+    away) and have to decode to width*height*4 bytes; everything else has to
+    fit inside the file.  Returns a list of every problem that was found, which
+    is empty if there weren't any.
+    """
+    errors = []
+    with open(assets_file_path, "rb") as assets_file:
+        file_len = os.fstat(assets_file.fileno()).st_size
+        if file_len < fmt.OFFSETS_START + fmt.offset_block_len():
+            return ["file is only %d bytes, too short for the offset table" % \
+                    file_len]
+        offset_table = read_offset_table(assets_file, fmt)
+        data = mmap.mmap(assets_file.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(data)
+    try:
+        for index, offset in enumerate(offset_table['img']):
+            what = "img %d" % index
+            if verbose:
+                print("scanning %s..." % what)
+            if offset + IMG_HEADER.size > file_len:
+                errors.append("%s: header is past the end of the file" % what)
+                continue
+            header = IMG_HEADER.unpack_from(data, offset)
+            img_w, img_h, img_len = header[0], header[1], header[6]
+            start = offset + IMG_HEADER.size
+            if start + img_len > file_len:
+                errors.append("%s: %d bytes long but only %d bytes are left in the file" % \
+                              (what, img_len, file_len - start))
+                continue
+            blob = view[start:start + img_len]
+            if fmt.image_format == 'chowdren':
+                img_errors = check_img(blob, img_w * img_h * 4)
+            else:
+                img_errors = scan_zlib_img(blob, img_w * img_h * 4)
+            blob.release()
+            errors.extend("%s: %s" % (what, err) for err in img_errors)
+
+        for index, offset in enumerate(offset_table['sound']):
+            scan_text(data, offset + 4, "sound %d" % index, errors)
+
+        for index, offset in enumerate(offset_table['font']):
+            scan_font_entry(data, offset, "font %d" % index, errors)
+
+        for index, offset in enumerate(offset_table['shader']):
+            frag_offset = scan_text(data, offset, "shader %d vert" % index, \
+                                    errors)
+            if frag_offset is not None:
+                scan_text(data, frag_offset, "shader %d frag" % index, errors)
+
+        for index, offset in enumerate(offset_table['file']):
+            scan_text(data, offset, "file %d" % index, errors)
+    finally:
+        view.release()
+        data.close()
+    return errors
+
+def load_format(metadata_json):
+    """
+    read the format metadata json at metadata_json and return it as an
+    assets_format.
+    """
+    with open(metadata_json, 'r') as meta_file:
+        return assets_format(json.loads(meta_file.read()))
+
+def known_format(csum):
+    """
+    returns the assets_format of the official release whose Assets.dat has the
+    md5sum csum, or None if csum isn't an official release.
+    """
+    fmt = KNOWN_FORMATS.get(csum)
+    if fmt is None:
+        return None
+    return assets_format(fmt)
+
+def md5sum(path):
+    hasher = hashlib.md5()
+    stream = open(path, "rb")
+    buf = stream.read(4096)
+    while buf:
+        hasher.update(buf)
+        buf = stream.read(4096)
+    stream.close()
+    return hasher.hexdigest()
+
@@ -0,0 +1,170 @@
+################################################################################
+#
+# contact: snickerbockers@washemu.org
+#
+# I choose to release this file into the public domain.
+# I am not responsible for any failures of this program or damage caused by it.
+# You have the right to remove this statement, but I'd prefer it if you didn't.
+#     -- SnickerBockers was here, 2023
+#
+################################################################################
+
+# Packs the images in Assets.dat into a handful of big atlas pngs instead of
+# one png (and one _meta.txt) per image.  There are over 17,000 images in the
+# latest version of the game, and on some filesystems creating that many
+# little files takes longer than actually decoding them.
+#
+# Every atlas_%d.png goes in the images/ directory along with atlas.json,
+# which maps each image index to the sheet and rectangle it was packed into
+# plus the four mystery integers that would otherwise be in its _meta.txt.
+#
+# Images are packed in index order so that both extracting and building only
+# ever need to have one sheet in memory at a time.
+
+import os
+import json
+
+# default width and height of each atlas sheet.  Images which are bigger than
+# this get a sheet all to themselves.
+ATLAS_SHEET_SIZE = 4096
+
+ATLAS_MAP_NAME = "atlas.json"
+
+def has_atlas(img_dir):
+    """
+    returns True if the images in img_dir were extracted into atlases
+    """
+    return os.path.exists(os.path.join(img_dir, ATLAS_MAP_NAME))
+
+class shelf_packer:
+    """
+    places rectangles on a sheet in rows ("shelves").  Each rectangle goes on
+    the first shelf that's tall enough and still has room for it; if there
+    isn't one, a new shelf is started underneath all the others.  Consecutive
+    images are usually frames of the same animation, so this packs them pretty
+    tightly even though it never looks ahead.
+    """
+    def __init__(self, sheet_w, sheet_h):
+        self.sheet_w = sheet_w
+        self.sheet_h = sheet_h
+
+        # each shelf is [y, height, next free x]
+        self.shelves = []
+        self.used_w = 0
+        self.used_h = 0
+
+    def place(self, w, h):
+        """
+        returns the (x, y) position to put a w*h rectangle at, or None if there
+        is no room left for it on this sheet.
+        """
+        for shelf in self.shelves:
+            if h <= shelf[1] and shelf[2] + w <= self.sheet_w:
+                pos = (shelf[2], shelf[0])
+                shelf[2] += w
+                self.used_w = max(self.used_w, shelf[2])
+                return pos
+
+        if w > self.sheet_w or self.used_h + h > self.sheet_h:
+            return None
+        self.shelves.append([self.used_h, h, w])
+        pos = (0, self.used_h)
+        self.used_w = max(self.used_w, w)
+        self.used_h += h
+        return pos
+
+class atlas_writer:
+    """
+    collects decoded images into atlas sheets under img_dir.  Call add for
+    every image in index order and then close to save the last sheet and
+    atlas.json.
+    """
+    def __init__(self, img_dir, sheet_size=ATLAS_SHEET_SIZE):
+        self.img_dir = img_dir
+        self.sheet_size = sheet_size
+        self.sheets = []
+        self.images = {}
+        self.packer = None
+        self.sheet = None
+
+    def save_sheet(self):
+        if self.sheet is None:
+            return
+        sheet_path = os.path.join(self.img_dir, self.sheets[-1])
+        self.sheet.crop((0, 0, self.packer.used_w, self.packer.used_h)) \
+                  .save(sheet_path)
+        self.sheet = None
+        self.packer = None
+
+    def new_sheet(self, sheet_w, sheet_h):
+        from PIL import Image
+        self.save_sheet()
+        self.sheets.append("atlas_%d.png" % len(self.sheets))
+        self.sheet = Image.new("RGBA", (sheet_w, sheet_h), (0, 0, 0, 0))
+        self.packer = shelf_packer(sheet_w, sheet_h)
+
+    def add(self, index, img_w, img_h, meta, bts):
+        """
+        pack the img_w*img_h RGBA image bts.  meta is the list of the four
+        mystery integers from its header.
+        """
+        from PIL import Image
+        rect = { "sheet" : None, "x" : 0, "y" : 0, "w" : img_w, "h" : img_h,
+                 "meta" : list(meta) }
+        self.images[str(index)] = rect
+        if img_w == 0 or img_h == 0:
+            return
+
+        pos = None
+        if self.packer is not None:
+            pos = self.packer.place(img_w, img_h)
+        if pos is None:
+            self.new_sheet(max(img_w, self.sheet_size), \
+                           max(img_h, self.sheet_size))
+            pos = self.packer.place(img_w, img_h)
+
+        rect['sheet'] = len(self.sheets) - 1
+        rect['x'], rect['y'] = pos
+        self.sheet.paste(Image.frombytes("RGBA", (img_w, img_h), bts), pos)
+
+    def close(self):
+        self.save_sheet()
+        with open(os.path.join(self.img_dir, ATLAS_MAP_NAME), "w") as map_file:
+            json.dump({ "sheets" : self.sheets, "images" : self.images }, \
+                      map_file)
+
+class atlas_reader:
+    """
+    slices images back out of the atlas sheets saved by atlas_writer.  Only the
+    most recently used sheet is kept in memory, so ask for images in index
+    order.
+    """
+    def __init__(self, img_dir):
+        self.img_dir = img_dir
+        with open(os.path.join(img_dir, ATLAS_MAP_NAME), "r") as map_file:
+            atlas_map = json.load(map_file)
+        self.sheets = atlas_map['sheets']
+        self.images = atlas_map['images']
+        self.cur_sheet_no = None
+        self.cur_sheet = None
+
+    def get(self, index):
+        """
+        returns a tuple of (width, height, meta, RGBA data) for image index
+        """
+        from PIL import Image
+        rect = self.images[str(index)]
+        img_w = rect['w']
+        img_h = rect['h']
+        if img_w == 0 or img_h == 0:
+            return (img_w, img_h, rect['meta'], bytes())
+
+        if rect['sheet'] != self.cur_sheet_no:
+            sheet_path = os.path.join(self.img_dir, self.sheets[rect['sheet']])
+            self.cur_sheet = Image.open(sheet_path).convert("RGBA")
+            self.cur_sheet_no = rect['sheet']
+
+        x = rect['x']
+        y = rect['y']
+        img = self.cur_sheet.crop((x, y, x + img_w, y + img_h))
+        return (img_w, img_h, rect['meta'], img.tobytes())
@@ -0,0 +1,141 @@
+################################################################################
+#
+# contact: snickerbockers@washemu.org
+#
+# I choose to release this file into the public domain.
+# I am not responsible for any failures of this program or damage caused by it.
+# You have the right to remove this statement, but I'd prefer it if you didn't.
+#     -- SnickerBockers was here, 2023
+#
+################################################################################
+
+# A cache of decoded images which is kept on disk between runs, so that
+# extracting the Linux, Windows and Switch versions of Assets.dat (or two
+# versions of the same one) only decodes the images that actually differ.
+#
+# Entries are keyed by the md5 of an image's compressed data plus the image
+# format of the archive it came from, so the same sprite is shared between
+# every archive that contains it.  Each entry is either the decoded RGBA data
+# (".rgba", for atlases) or the encoded png (".png") and is saved as
+# <cache dir>/<first two hex digits>/<key>.<kind>.  Images of different sizes
+# with the same pixels (a blank 16x16 and a blank 32x8) have the same
+# compressed data, so png keys also have the size in them.
+#
+# Once everything in the cache adds up to more than max_len bytes the least
+# recently used entries are deleted.  Using an entry bumps its mtime, which is
+# how the order is remembered between runs.
+
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+# default maximum size of everything in the cache
+DECODE_CACHE_SIZE = 1024 * 1024 * 1024
+
+DECODE_CACHE_KINDS = ("rgba", "png")
+
+class decode_cache:
+    """
+    persistent LRU cache of decoded images in cache_dir
+    """
+    def __init__(self, cache_dir, max_len=DECODE_CACHE_SIZE):
+        self.cache_dir = cache_dir
+        self.max_len = max_len
+        self.cur_len = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, 0o755, exist_ok=True)
+
+        # path => length, least recently used first
+        self.entries = OrderedDict()
+        found = []
+        for subdir in os.scandir(cache_dir):
+            if not subdir.is_dir():
+                continue
+            for entry in os.scandir(subdir.path):
+                if entry.name.rpartition('.')[2] not in DECODE_CACHE_KINDS:
+                    continue
+                stat = entry.stat()
+                found.append((stat.st_mtime, entry.path, stat.st_size))
+        found.sort()
+        for mtime, path, length in found:
+            self.entries[path] = length
+            self.cur_len += length
+        self.evict()
+
+    def key(self, fmt, blob, img_w=None, img_h=None):
+        """
+        returns the key for the compressed image data blob from an archive
+        described by the assets_format fmt.  Keys of png entries have to
+        include the image's img_w and img_h.
+        """
+        key = "%s-%s" % (hashlib.md5(blob).hexdigest(), fmt.image_format)
+        if img_w is not None:
+            key += "-%dx%d" % (img_w, img_h)
+        return key
+
+    def entry_path(self, key, kind):
+        if kind not in DECODE_CACHE_KINDS:
+            raise ValueError("unknown decode cache entry kind \"%s\"" % kind)
+        return os.path.join(self.cache_dir, key[:2], "%s.%s" % (key, kind))
+
+    def get(self, key, kind):
+        """
+        returns the cached bytes for key, or None if they aren't cached
+        """
+        path = self.entry_path(key, kind)
+        try:
+            with open(path, "rb") as entry_file:
+                dat = entry_file.read()
+            os.utime(path)
+        except FileNotFoundError:
+            with self.lock:
+                self.misses += 1
+                # another process might have evicted it
+                old_len = self.entries.pop(path, None)
+                if old_len is not None:
+                    self.cur_len -= old_len
+            return None
+
+        with self.lock:
+            self.hits += 1
+            if path in self.entries:
+                self.entries.move_to_end(path)
+            else:
+                # another process put it there
+                self.entries[path] = len(dat)
+                self.cur_len += len(dat)
+        return dat
+
+    def put(self, key, kind, dat):
+        """
+        save dat in the cache under key.  Entries are written to a temporary
+        file first, so other processes never see half of one.
+        """
+        if len(dat) > self.max_len:
+            return
+        path = self.entry_path(key, kind)
+        os.makedirs(os.path.dirname(path), 0o755, exist_ok=True)
+        tmp_path = "%s.%d.%d.tmp" % (path, os.getpid(), threading.get_ident())
+        with open(tmp_path, "wb") as entry_file:
+            entry_file.write(dat)
+        os.replace(tmp_path, path)
+
+        with self.lock:
+            old_len = self.entries.pop(path, None)
+            if old_len is not None:
+                self.cur_len -= old_len
+            self.entries[path] = len(dat)
+            self.cur_len += len(dat)
+            self.evict()
+
+    def evict(self):
+        while self.cur_len > self.max_len:
+            path, length = self.entries.popitem(last=False)
+            self.cur_len -= length
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,416 @@
+################################################################################
+#
+# contact: snickerbockers@washemu.org
+#
+# I choose to release this file into the public domain.
+# I am not responsible for any failures of this program or damage caused by it.
+# You have the right to remove this statement, but I'd prefer it if you didn't.
+#     -- SnickerBockers was here, 2023
+#
+################################################################################
+
+# A daemon that listens on a unix socket so editor plugins and build scripts
+# can decode, compress and patch without starting python, importing PIL,
+# identifying Assets.dat and spinning up worker processes every time.  It
+# keeps every archive it's asked about mmap'd (until the file changes) and
+# keeps a pool of worker processes around which have already imported
+# everything and have their own copies of those archives open.
+#
+# Every message in either direction is one line of json, followed by exactly
+# "len" bytes of data if the json has a "len".  A connection can send as many
+# requests as it wants, one after another.  Each request gets any number of
+# replies and then either {"done": true, ...} or {"error": "..."}.
+#
+#     {"op": "extract", "archive": path, "class": "img", "start": 0,
+#      "stop": 10, "encode": "png"}
+#         one reply per entry from start up to stop, in order, as soon as
+#         it's ready.  Images are "png", "rgba" or "raw" (exactly as stored)
+#         and come with their "width" and "height".  Sounds are ogg files,
+#         text files are text and shaders are the vertex source followed by
+#         the fragment source ("vert_len" says where it splits).
+#     {"op": "compress", "image_format": "chowdren", "len": n}
+#         compresses the RGBA data that follows and replies with it
+#     {"op": "patch", "archive": path, "out": path, "class": "img",
+#      "index": i, "width": w, "height": h, "len": n}
+#         saves a copy of the archive to out with one entry replaced (see
+#         fpassets.replace_entry).  Images are sent as RGBA and compressed
+#         here, keeping their old meta unless "meta" is given.  Sounds are
+#         ogg files (keeping their old meta) and text files are text.  With
+#         "raw": true the data is the whole entry exactly as it's stored.
+#     {"op": "verify", "archive": path}
+#         one {"problem": "..."} reply for everything fpassets.scan_assets
+#         finds
+#
+# Any request about an archive can include its "format" (the contents of a
+# format.json); otherwise it has to be an official release.  Paths have to be
+# absolute since the daemon's working directory isn't the client's.  Only the
+# user running the daemon can connect to its socket.  See daemon_request for
+# a client.
+
+import os
+import json
+import stat
+import socket
+import struct
+import signal
+import socketserver
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from fpassets import assets_archive, assets_format, known_format, md5sum, \
+    encode_png, replace_entry, scan_assets, compress_img_data, \
+    archive_stamp, IMG_HEADER
+
+# how many entries of an extract request go to a worker at a time
+DAEMON_CHUNK_SIZE = 16
+
+# archives each worker process has open, by path: (stamp, assets_archive)
+worker_archives = {}
+
+def warm_worker():
+    # import PIL now so that the first request doesn't have to wait for it
+    from PIL import Image
+
+def open_worker_archive(assets_file_path, fmt_json, stamp):
+    cached = worker_archives.get(assets_file_path)
+    if cached is None or cached[0] != stamp:
+        if cached is not None:
+            cached[1].close()
+        cached = (stamp, assets_archive(assets_file_path, \
+                                        assets_format(fmt_json)))
+        worker_archives[assets_file_path] = cached
+    return cached[1]
+
+def decode_chunk(assets_file_path, fmt_json, stamp, indices, encode):
+    archive = open_worker_archive(assets_file_path, fmt_json, stamp)
+    out = []
+    for index in indices:
+        img_w, img_h, bts = archive.decode_img(index)
+        if encode == "png" and img_w and img_h:
+            bts = encode_png(img_w, img_h, bts)
+        out.append((index, img_w, img_h, bts))
+    return out
+
+class image_format_only:
+    """
+    stands in for an assets_format when all that's known is the image format
+    """
+    def __init__(self, image_format):
+        if image_format not in ('zlib', 'chowdren'):
+            raise ValueError("unknown image compression format %s" % \
+                             image_format)
+        self.image_format = image_format
+
+def compress_data(fmt, bts):
+    return compress_img_data(fmt, bts, "image", quiet=True)
+
+def check_range(start, stop, count):
+    if type(start) is not int or type(stop) is not int or \
+       not 0 <= start <= stop <= count:
+        raise ValueError("start %r and stop %r aren't a range of the %d entries" % \
+                         (start, stop, count))
+
+def check_index(index, count):
+    if type(index) is not int or not 0 <= index < count:
+        raise ValueError("index %r isn't one of the %d entries" % \
+                         (index, count))
+
+def request_path(request, key):
+    path = request[key]
+    if not os.path.isabs(path):
+        raise ValueError("%s has to be an absolute path, not %s" % (key, path))
+    return path
+
+class open_archives:
+    """
+    the archives the daemon has open, by path.  Each one is opened again if
+    its size or modification time changes.
+    """
+    def __init__(self):
+        self.archives = {}
+        self.lock = threading.Lock()
+
+    def get(self, assets_file_path, fmt_json=None):
+        """
+        returns a tuple of (assets_archive, stamp) for assets_file_path
+        """
+        stamp = archive_stamp(assets_file_path)
+        with self.lock:
+            cached = self.archives.get(assets_file_path)
+            if cached is not None and cached[1] == stamp and \
+               (fmt_json is None or fmt_json == cached[0].fmt.to_json()):
+                return (cached[0], stamp)
+
+            if fmt_json is not None:
+                fmt = assets_format(fmt_json)
+            else:
+                fmt = known_format(md5sum(assets_file_path))
+                if fmt is None:
+                    raise ValueError("%s isn't an official release; send its format" % assets_file_path)
+            if cached is not None:
+                # another thread might still be using the old one, so it's
+                # left for the garbage collector
+                del self.archives[assets_file_path]
+            archive = assets_archive(assets_file_path, fmt)
+            self.archives[assets_file_path] = (archive, stamp)
+            return (archive, stamp)
+
+class daemon_handler(socketserver.StreamRequestHandler):
+    def send(self, header, payload=None):
+        if payload is not None:
+            header['len'] = len(payload)
+        self.wfile.write(json.dumps(header).encode() + b"\n")
+        if payload:
+            self.wfile.write(payload)
+
+    def send_error(self, err):
+        self.send({ "error" : "%s: %s" % (type(err).__name__, err) })
+
+    def request_archive(self, request):
+        return self.server.archives.get(request_path(request, 'archive'), \
+                                        request.get('format'))
+
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError("requests have to be json objects")
+                length = request.get('len', 0)
+                if type(length) is not int or length < 0:
+                    # there's no telling where the next request starts
+                    try:
+                        self.send_error(ValueError("bad len %r" % (length,)))
+                    except OSError:
+                        pass
+                    return
+                payload = None
+                if 'len' in request:
+                    payload = self.rfile.read(length)
+                    if len(payload) != length:
+                        return
+                handler = getattr(self, "op_%s" % request.get('op'), None)
+                if handler is None:
+                    raise ValueError("unknown op %s" % request.get('op'))
+                handler(request, payload)
+            except (ValueError, KeyError, IndexError, TypeError, \
+                    OSError, RuntimeError, struct.error, zlib.error) as err:
+                if isinstance(err, BrokenProcessPool):
+                    # a worker died; the next request gets a new pool
+                    self.server.restart_pool()
+                try:
+                    self.send_error(err)
+                except OSError:
+                    return
+
+    def op_ping(self, request, payload):
+        self.send({ "done" : True })
+
+    def op_extract(self, request, payload):
+        archive, stamp = self.request_archive(request)
+        asset_class = request.get('class', 'img')
+        start = request.get('start', 0)
+        stop = request.get('stop', archive.count(asset_class))
+        check_range(start, stop, archive.count(asset_class))
+        encode = request.get('encode', 'png')
+        if asset_class == 'img' and encode in ('png', 'rgba'):
+            chunks = [range(chunk_start, min(chunk_start + DAEMON_CHUNK_SIZE, \
+                                             stop)) \
+                      for chunk_start in range(start, stop, DAEMON_CHUNK_SIZE)]
+            n_chunks = len(chunks)
+            results = self.server.pool.map(decode_chunk, \
+                                           [archive.path] * n_chunks, \
+                                           [archive.fmt.to_json()] * n_chunks, \
+                                           [stamp] * n_chunks, chunks, \
+                                           [encode] * n_chunks)
+            for chunk in results:
+                for index, img_w, img_h, bts in chunk:
+                    self.send({ "index" : index, "width" : img_w, \
+                                "height" : img_h }, bts)
+        elif asset_class == 'img':
+            for index in range(start, stop):
+                img_w, img_h, meta, file_len = archive.img_header(index)
+                self.send({ "index" : index, "width" : img_w, \
+                            "height" : img_h, "meta" : meta }, \
+                          archive.img_blob(index))
+        elif asset_class == 'sound':
+            for index in range(start, stop):
+                meta, ogg = archive.sound(index)
+                self.send({ "index" : index, "meta" : meta }, ogg)
+        elif asset_class == 'shader':
+            for index in range(start, stop):
+                vert, frag = archive.shader(index)
+                self.send({ "index" : index, "vert_len" : len(vert) }, \
+                          vert + frag)
+        elif asset_class == 'file':
+            for index in range(start, stop):
+                self.send({ "index" : index }, archive.text_file(index))
+        else:
+            raise ValueError("can't extract %s entries" % asset_class)
+        self.send({ "done" : True })
+
+    def op_compress(self, request, payload):
+        fmt = image_format_only(request['image_format'])
+        data = self.server.pool.submit(compress_data, fmt, payload).result()
+        self.send({ "done" : True }, data)
+
+    def op_patch(self, request, payload):
+        archive, stamp = self.request_archive(request)
+        asset_class = request['class']
+        index = request['index']
+        check_index(index, archive.count(asset_class))
+        if request.get('raw'):
+            entry = payload
+        elif asset_class == 'img':
+            img_w = request['width']
+            img_h = request['height']
+            if len(payload) != img_w * img_h * 4:
+                raise ValueError("%dx%d image should be %d bytes, not %d" % \
+                                 (img_w, img_h, img_w * img_h * 4, len(payload)))
+            meta = request.get('meta') or archive.img_header(index)[2]
+            data = self.server.pool.submit(compress_data, archive.fmt, \
+                                           payload).result()
+            entry = IMG_HEADER.pack(img_w, img_h, meta[0], meta[1], meta[2], \
+                                    meta[3], len(data)) + data
+        elif asset_class == 'sound':
+            meta = request.get('meta') or archive.sound(index)[0]
+            entry = bytes(meta) + struct.pack("<I", len(payload)) + payload
+        elif asset_class == 'file':
+            entry = struct.pack("<I", len(payload)) + payload
+        else:
+            raise ValueError("%s entries can only be patched with raw data" % \
+                             asset_class)
+        replace_entry(archive, asset_class, index, entry, \
+                      request_path(request, 'out'))
+        self.send({ "done" : True })
+
+    def op_verify(self, request, payload):
+        archive, stamp = self.request_archive(request)
+        problems = scan_assets(archive.path, archive.fmt)
+        for problem in problems:
+            self.send({ "problem" : problem })
+        self.send({ "done" : True, "problems" : len(problems) })
+
+def remove_stale_socket(socket_path):
+    """
+    delete the socket left at socket_path by a daemon that didn't shut down
+    cleanly.  Raises ValueError if something else is there or a daemon is
+    still listening on it.
+    """
+    try:
+        mode = os.stat(socket_path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise ValueError("%s already exists and isn't a socket" % socket_path)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_path)
+        except ConnectionRefusedError:
+            os.remove(socket_path)
+            return
+    raise ValueError("a daemon is already listening on %s" % socket_path)
+
+class assets_daemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    UnixStreamServer listening on socket_path which handles every connection
+    on its own thread and sends decoding and compression off to a pool of
+    n_jobs worker processes
+    """
+    daemon_threads = True
+
+    def __init__(self, socket_path, n_jobs=None):
+        remove_stale_socket(socket_path)
+        socketserver.UnixStreamServer.__init__(self, socket_path, \
+                                               daemon_handler)
+        self.socket_path = socket_path
+        self.archives = open_archives()
+        if n_jobs is None:
+            n_jobs = os.cpu_count() or 1
+        self.n_jobs = n_jobs
+        self.pool_lock = threading.Lock()
+        self.pool = self.start_pool()
+
+    def server_bind(self):
+        socketserver.UnixStreamServer.server_bind(self)
+        # anyone who can connect can have the daemon write anywhere its owner
+        # can, so only its owner gets to
+        os.chmod(self.server_address, 0o600)
+
+    def start_pool(self):
+        pool = ProcessPoolExecutor(self.n_jobs, initializer=warm_worker)
+        # start every worker now instead of on the first request
+        list(pool.map(int, range(self.n_jobs)))
+        return pool
+
+    def restart_pool(self):
+        """
+        replace the worker pool if one of its processes died
+        """
+        with self.pool_lock:
+            try:
+                self.pool.submit(int).result()
+            except BrokenProcessPool:
+                self.pool.shutdown(wait=False)
+                self.pool = self.start_pool()
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        self.pool.shutdown()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+def stop_daemon(signum, frame):
+    raise KeyboardInterrupt()
+
+def run_daemon(socket_path, n_jobs=None):
+    """
+    serve requests on socket_path until interrupted or terminated
+    """
+    server = assets_daemon(socket_path, n_jobs)
+    signal.signal(signal.SIGTERM, stop_daemon)
+    print("listening on %s" % socket_path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+def daemon_request(socket_path, request, payload=None):
+    """
+    send request (a dict) and its payload to the daemon on socket_path and
+    yield every reply as a tuple of (header dict, data or None).  The final
+    reply is the one with "done" in it; an error reply raises ValueError.
+    Relative "archive" and "out" paths are made absolute first.
+    """
+    request = dict(request)
+    for key in ('archive', 'out'):
+        if key in request:
+            request[key] = os.path.abspath(request[key])
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        stream = sock.makefile("rwb")
+        if payload is not None:
+            request['len'] = len(payload)
+        stream.write(json.dumps(request).encode() + b"\n")
+        if payload:
+            stream.write(payload)
+        stream.flush()
+        while True:
+            line = stream.readline()
+            if not line:
+                raise ValueError("daemon hung up")
+            header = json.loads(line)
+            data = None
+            if 'len' in header:
+                data = stream.read(header['len'])
+            if 'error' in header:
+                raise ValueError(header['error'])
+            yield (header, data)
+            if header.get('done'):
+                return
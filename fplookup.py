@@ -0,0 +1,131 @@
+################################################################################
+#
+# contact: snickerbockers@washemu.org
+#
+# I choose to release this file into the public domain.
+# I am not responsible for any failures of this program or damage caused by it.
+# You have the right to remove this statement, but I'd prefer it if you didn't.
+#     -- SnickerBockers was here, 2023
+#
+################################################################################
+
+# Finds which img_%d a png came from, without extracting anything.
+#
+# The lookup index has the md5 of every image's decoded RGBA data along with
+# its index and size, and optionally a 64-bit difference hash ("dhash") of
+# what the image looks like.  A png that was edited a little (or saved by a
+# program which changed the colors of transparent pixels) won't have the same
+# md5 anymore, but its dhash will still be close to the original's.
+#
+# The index is saved next to Assets.dat as <Assets.dat>.lookup.json and
+# isn't used anymore once the archive's size or modification time changes.
+# Building it decodes every image on a pool of worker processes, the same way
+# fpanalyze.py does (see fpassets.map_images).
+
+import json
+import hashlib
+from fpassets import map_images, archive_stamp
+
+LOOKUP_INDEX_SUFFIX = ".lookup.json"
+
+# images whose dhashes are at most this many bits apart count as similar
+DHASH_MAX_DISTANCE = 6
+
+def lookup_index_path(assets_file_path):
+    return assets_file_path + LOOKUP_INDEX_SUFFIX
+
+def dhash(img_w, img_h, bts):
+    """
+    returns the 64-bit difference hash of the img_w*img_h RGBA data bts.  The
+    image is drawn on black first so the color of transparent pixels doesn't
+    matter, shrunk to 9x8 grayscale, and then each bit says whether a pixel
+    is brighter than the one to its right.
+    """
+    from PIL import Image
+    if img_w == 0 or img_h == 0:
+        return 0
+    img = Image.frombytes("RGBA", (img_w, img_h), bts)
+    backdrop = Image.new("RGBA", (img_w, img_h), (0, 0, 0, 255))
+    small = Image.alpha_composite(backdrop, img).convert("L") \
+                 .resize((9, 8), Image.BILINEAR)
+    pixels = small.tobytes()
+    val = 0
+    for row in range(8):
+        for col in range(8):
+            val = (val << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return val
+
+def hash_img(archive, index, use_dhash):
+    img_w, img_h, bts = archive.decode_img(index)
+    row = [index, img_w, img_h, hashlib.md5(bts).hexdigest(), None]
+    if use_dhash:
+        row[4] = dhash(img_w, img_h, bts)
+    return row
+
+def build_lookup_index(assets_file_path, fmt, n_jobs=None, use_dhash=False):
+    """
+    decode every image in the Assets.dat at assets_file_path (described by the
+    assets_format fmt) and return the lookup index for it.  Rows of the index
+    are [index, width, height, md5 of the RGBA data, dhash or None].
+    """
+    images = map_images(assets_file_path, fmt, hash_img, (use_dhash,), n_jobs)
+    return { "archive" : archive_stamp(assets_file_path),
+             "dhash" : use_dhash, "images" : images }
+
+def save_lookup_index(assets_file_path, lookup_index):
+    with open(lookup_index_path(assets_file_path), "w") as index_file:
+        json.dump(lookup_index, index_file)
+
+def load_lookup_index(assets_file_path):
+    """
+    returns the saved lookup index for the Assets.dat at assets_file_path, or
+    None if there isn't one or the archive changed since it was made
+    """
+    try:
+        with open(lookup_index_path(assets_file_path), "r") as index_file:
+            lookup_index = json.load(index_file)
+    except FileNotFoundError:
+        return None
+    if lookup_index.get("archive") != archive_stamp(assets_file_path):
+        return None
+    return lookup_index
+
+class image_lookup:
+    """
+    answers lookups against a lookup index
+    """
+    def __init__(self, lookup_index):
+        self.images = lookup_index['images']
+        self.use_dhash = lookup_index['dhash']
+        self.by_hash = {}
+        for row in self.images:
+            self.by_hash.setdefault(row[3], []).append(row)
+
+    def find(self, img_w, img_h, bts, max_distance=DHASH_MAX_DISTANCE):
+        """
+        returns a list of (index, dhash distance) for every image that matches
+        the img_w*img_h RGBA data bts.  Exact matches have a distance of None
+        and are the only ones returned if there are any; otherwise, if the index
+        has dhashes, every image of the same size within max_distance bits is
+        returned, closest first.
+        """
+        exact = [(row[0], None) for row in \
+                 self.by_hash.get(hashlib.md5(bts).hexdigest(), []) \
+                 if row[1] == img_w and row[2] == img_h]
+        if exact or not self.use_dhash:
+            return exact
+
+        val = dhash(img_w, img_h, bts)
+        similar = []
+        for row in self.images:
+            if row[1] == img_w and row[2] == img_h:
+                distance = bin(val ^ row[4]).count("1")
+                if distance <= max_distance:
+                    similar.append((row[0], distance))
+        similar.sort(key=lambda match: match[1])
+        return similar
+
+    def find_png(self, png_path, max_distance=DHASH_MAX_DISTANCE):
+        from PIL import Image
+        img = Image.open(png_path).convert("RGBA")
+        return self.find(img.width, img.height, img.tobytes(), max_distance)
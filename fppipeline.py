@@ -0,0 +1,88 @@
+################################################################################
+#
+# contact: snickerbockers@washemu.org
+#
+# I choose to release this file into the public domain.
+# I am not responsible for any failures of this program or damage caused by it.
+# You have the right to remove this statement, but I'd prefer it if you didn't.
+#     -- SnickerBockers was here, 2023
+#
+################################################################################
+
+# Runs items through a chain of stages, each with its own pool of threads,
+# connected by bounded queues.  Extracting an image means reading it out of
+# Assets.dat, decoding it, encoding a png and writing that to disk, and doing
+# those one after another leaves either the disk or the CPU idle most of the
+# time.  With a pipeline they overlap, and since every queue is bounded a slow
+# stage makes the ones in front of it wait instead of piling everything up in
+# memory.
+#
+# Threads are enough for anything which releases the GIL (zlib, png encoding,
+# file I/O).  A stage that doesn't can hand its work off to a process pool
+# from inside its threads, see fpassets.extract_images_pipelined.
+
+import queue
+import threading
+
+# default number of items that can wait between two stages
+PIPELINE_QUEUE_LEN = 16
+
+# put in a stage's queue once for each of its threads when there's no more
+# input coming
+PIPELINE_DONE = object()
+
+def run_pipeline(items, stages, queue_len=PIPELINE_QUEUE_LEN):
+    """
+    feed every item in items (from the calling thread) through stages, which
+    is a list of (function, number of threads).  Whatever each function
+    returns is passed on to the next stage; returning None drops the item.
+    If any stage raises an exception, everything still in flight is thrown
+    away and the first exception is raised again once every thread stops.
+    """
+    queues = [queue.Queue(queue_len) for stage in stages]
+    errors = []
+    failed = threading.Event()
+
+    def stage_worker(stage_no):
+        func = stages[stage_no][0]
+        while True:
+            item = queues[stage_no].get()
+            if item is PIPELINE_DONE:
+                return
+            if failed.is_set():
+                # keep draining the queue so nothing upstream blocks
+                continue
+            try:
+                out = func(item)
+            except Exception as err:
+                errors.append(err)
+                failed.set()
+                continue
+            if out is not None and stage_no + 1 < len(stages):
+                queues[stage_no + 1].put(out)
+
+    threads = []
+    for stage_no, (func, n_threads) in enumerate(stages):
+        stage_threads = [threading.Thread(target=stage_worker, \
+                                          args=(stage_no,), daemon=True) \
+                         for thread_no in range(max(n_threads, 1))]
+        for thread in stage_threads:
+            thread.start()
+        threads.append(stage_threads)
+
+    try:
+        for item in items:
+            if failed.is_set():
+                break
+            queues[0].put(item)
+    finally:
+        # each stage only gets told to stop once every thread in the stage
+        # before it has finished, so nothing is left behind in the queues
+        for stage_no, stage_threads in enumerate(threads):
+            for thread in stage_threads:
+                queues[stage_no].put(PIPELINE_DONE)
+            for thread in stage_threads:
+                thread.join()
+
+    if errors:
+        raise errors[0]
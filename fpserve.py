@@ -0,0 +1,258 @@
+################################################################################
+#
+# contact: snickerbockers@washemu.org
+#
+# I choose to release this file into the public domain.
+# I am not responsible for any failures of this program or damage caused by it.
+# You have the right to remove this statement, but I'd prefer it if you didn't.
+#     -- SnickerBockers was here, 2023
+#
+################################################################################
+
+# A little http server that hands out individual assets straight out of an
+# Assets.dat, for tools that want to preview a few sprites or sounds without
+# extracting all of them first.  It only listens on localhost.
+#
+#     /image/<index>.png        decoded image
+#     /image/<index>.bin        image exactly as stored (see -r)
+#     /image/<index>/rows/<first>-<last>.png
+#                               only rows first through last (exclusive),
+#                               which have to be inside the image
+#     /thumb/<index>.png        image scaled down to fit in 128x128; only
+#                               the top ?rows=<n> rows if that's given
+#     /audio/<index>.ogg        sound
+#     /shader/<index>/vert      vertex shader source
+#     /shader/<index>/frag      fragment shader source
+#     /file/<index>.txt         text file
+#
+# Everything is decoded on demand and the encoded responses are kept in an
+# LRU cache, keyed by the route plus whichever query parameters it uses.  Each response's ETag is the md5 of the entry as it's stored in
+# Assets.dat, so clients can revalidate without anything being decoded.
+
+import io
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs
+from fpassets import assets_archive
+
+# default amount of encoded responses kept in memory
+SERVE_CACHE_SIZE = 64 * 1024 * 1024
+
+SERVE_ROUTES = (
+    (re.compile(r"^/image/(\d+)\.png$"), "img", "image/png"),
+    (re.compile(r"^/image/(\d+)\.bin$"), "img", "application/octet-stream"),
+    (re.compile(r"^/image/(\d+)/rows/(\d+)-(\d+)\.png$"), "img", "image/png"),
+    (re.compile(r"^/thumb/(\d+)\.png$"), "img", "image/png"),
+    (re.compile(r"^/audio/(\d+)\.ogg$"), "sound", "audio/ogg"),
+    (re.compile(r"^/shader/(\d+)/vert$"), "shader", "text/plain"),
+    (re.compile(r"^/shader/(\d+)/frag$"), "shader", "text/plain"),
+    (re.compile(r"^/file/(\d+)\.txt$"), "file", "text/plain"),
+)
+
+class response_cache:
+    """
+    LRU cache of encoded responses which evicts the least recently used ones
+    once the total length of everything in it goes over max_len.
+    """
+    def __init__(self, max_len=SERVE_CACHE_SIZE):
+        self.max_len = max_len
+        self.cur_len = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            val = self.entries.get(key)
+            if val is not None:
+                self.entries.move_to_end(key)
+            return val
+
+    def put(self, key, etag, body):
+        if len(body) > self.max_len:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.cur_len -= len(old[1])
+            self.entries[key] = (etag, body)
+            self.cur_len += len(body)
+            while self.cur_len > self.max_len:
+                evicted_etag, evicted_body = \
+                    self.entries.popitem(last=False)[1]
+                self.cur_len -= len(evicted_body)
+
+def check_request(archive, path, index, match, query):
+    """
+    check the parts of a request for path (which has already been matched to
+    entry index) besides the index.  Returns a tuple of the key its response
+    is cached under and the (first, last) rows of the image it asks for, or
+    None if it's the whole thing.  Raises ValueError if the request doesn't
+    make sense.
+    """
+    if path.startswith("/thumb/"):
+        max_rows = parse_qs(query).get("rows")
+        if max_rows is None:
+            return (path, None)
+        if not max_rows[0].isdigit() or int(max_rows[0]) == 0:
+            raise ValueError("rows has to be a positive number, not \"%s\"" % \
+                             max_rows[0])
+        max_rows = int(max_rows[0])
+        return ("%s?rows=%d" % (path, max_rows), (0, max_rows))
+    if "/rows/" in path:
+        first_row = int(match.group(2))
+        last_row = int(match.group(3))
+        img_h = archive.img_header(index)[1]
+        if first_row >= last_row or last_row > img_h:
+            raise ValueError("rows %d-%d aren't in image %d, which has %d rows" % \
+                             (first_row, last_row, index, img_h))
+        return (path, (first_row, last_row))
+    return (path, None)
+
+def encode_entry(archive, path, asset_class, index, rows=None):
+    """
+    returns the body of the response to path, which has already been matched
+    to entry index of asset_class and checked by check_request
+    """
+    if asset_class == "img":
+        if path.endswith(".bin"):
+            return archive.img_blob(index)
+        from PIL import Image
+        if path.startswith("/thumb/"):
+            max_rows = None
+            if rows is not None:
+                max_rows = rows[1]
+            return archive.img_thumbnail(index, max_rows=max_rows)
+        if rows is not None:
+            img_w, img_h, bts = archive.decode_rows(index, rows[0], rows[1])
+        else:
+            img_w, img_h, bts = archive.decode_img(index)
+        if img_w == 0 or img_h == 0:
+            raise ValueError("image %d has no pixels to encode" % index)
+        out = io.BytesIO()
+        Image.frombytes("RGBA", (img_w, img_h), bts).save(out, "png")
+        return out.getvalue()
+    elif asset_class == "sound":
+        return archive.sound(index)[1]
+    elif asset_class == "shader":
+        vert, frag = archive.shader(index)
+        if path.endswith("/vert"):
+            return vert
+        return frag
+    return archive.text_file(index)
+
+def etag_matches(etag, if_none_match):
+    """
+    returns True if etag is one of the ones listed in an If-None-Match header
+    """
+    if if_none_match is None:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag or tag == "*":
+            return True
+    return False
+
+class assets_request_handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path, sep, query = self.path.partition("?")
+        for pattern, asset_class, content_type in SERVE_ROUTES:
+            match = pattern.match(path)
+            if match:
+                break
+        else:
+            self.send_error(404)
+            return
+
+        archive = self.server.archive
+        index = int(match.group(1))
+        if index >= archive.count(asset_class):
+            self.send_error(404)
+            return
+
+        try:
+            cache_key, rows = check_request(archive, path, index, match, query)
+        except ValueError as err:
+            self.send_error(400, str(err))
+            return
+
+        cached = self.server.cache.get(cache_key)
+        if cached is None:
+            etag = '"%s"' % archive.entry_hash(asset_class, index)
+        else:
+            etag = cached[0]
+
+        if etag_matches(etag, self.headers.get("If-None-Match")):
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        if cached is None:
+            try:
+                body = encode_entry(archive, path, asset_class, index, rows)
+            except Exception as err:
+                self.send_error(500, str(err))
+                return
+            self.server.cache.put(cache_key, etag, body)
+        else:
+            body = cached[1]
+
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+class assets_server(HTTPServer):
+    """
+    HTTPServer which serves the assets in archive and handles requests on a
+    pool of n_threads worker threads
+    """
+    def __init__(self, archive, port, n_threads=None, \
+                 cache_len=SERVE_CACHE_SIZE, verbose=False):
+        HTTPServer.__init__(self, ("127.0.0.1", port), assets_request_handler)
+        self.archive = archive
+        self.cache = response_cache(cache_len)
+        self.verbose = verbose
+        self.pool = ThreadPoolExecutor(n_threads)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        HTTPServer.server_close(self)
+        self.pool.shutdown()
+
+def serve_assets(assets_file_path, fmt, port, n_threads=None, verbose=False):
+    """
+    serve the Assets.dat at assets_file_path (described by the assets_format
+    fmt) on localhost:port until interrupted
+    """
+    archive = assets_archive(assets_file_path, fmt)
+    server = assets_server(archive, port, n_threads, verbose=verbose)
+    print("serving %s on http://127.0.0.1:%d/" % (assets_file_path, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        archive.close()
@@ -0,0 +1,212 @@
+################################################################################
+#
+# contact: snickerbockers@washemu.org
+#
+# I choose to release this file into the public domain.
+# I am not responsible for any failures of this program or damage caused by it.
+# You have the right to remove this statement, but I'd prefer it if you didn't.
+#     -- SnickerBockers was here, 2023
+#
+################################################################################
+
+# Extracts an Assets.dat into a single SQLite database instead of a directory
+# tree of ~35,000 files, and builds a new Assets.dat back out of one.
+#
+# There's a table for each class of asset.  Every row keeps the entry's
+# index, its metadata and its data exactly as it was stored in Assets.dat
+# (so images are still compressed) along with the md5 of that data.  Images
+# can optionally also keep their decoded RGBA pixels.  To replace an image,
+# update its width, height and pixels and set its blob to NULL; the build
+# will compress the pixels again.  Everything else is copied back verbatim.
+#
+#     archive (format, preload, type_sizes)
+#     images  (idx, width, height, meta0-meta3, blob, hash, pixels)
+#     sounds  (idx, meta0-meta3, blob, hash)
+#     fonts   (idx, blob, hash)
+#     shaders (idx, vert, frag, hash)
+#     files   (idx, blob, hash)
+
+import os
+import json
+import struct
+import hashlib
+import sqlite3
+from fpassets import assets_archive, assets_format, IMG_HEADER, \
+    write_img_entry
+
+STORE_SCHEMA = """
+CREATE TABLE archive (format TEXT, preload BLOB, type_sizes TEXT);
+CREATE TABLE images (idx INTEGER PRIMARY KEY, width INTEGER, height INTEGER,
+                     meta0 INTEGER, meta1 INTEGER, meta2 INTEGER,
+                     meta3 INTEGER, blob BLOB, hash TEXT, pixels BLOB);
+CREATE TABLE sounds (idx INTEGER PRIMARY KEY, meta0 INTEGER, meta1 INTEGER,
+                     meta2 INTEGER, meta3 INTEGER, blob BLOB, hash TEXT);
+CREATE TABLE fonts (idx INTEGER PRIMARY KEY, blob BLOB, hash TEXT);
+CREATE TABLE shaders (idx INTEGER PRIMARY KEY, vert BLOB, frag BLOB,
+                      hash TEXT);
+CREATE TABLE files (idx INTEGER PRIMARY KEY, blob BLOB, hash TEXT);
+CREATE INDEX images_hash ON images (hash);
+CREATE INDEX images_dims ON images (width, height);
+CREATE INDEX sounds_hash ON sounds (hash);
+"""
+
+def md5_hex(dat):
+    return hashlib.md5(dat).hexdigest()
+
+def extract_to_db(assets_file_path, db_path, fmt, pixels=False, \
+                  verbose=False):
+    """
+    extract everything in the Assets.dat at assets_file_path (described by the
+    assets_format fmt) into a new SQLite database at db_path.  If pixels is
+    True every image is also decoded and its RGBA data saved.  The database is
+    built under a temporary name and only moved to db_path once it's done, so
+    nothing is left at db_path if this fails.
+    """
+    if os.path.exists(db_path):
+        raise FileExistsError("\"%s\" already exists" % db_path)
+
+    tmp_path = "%s.%d.tmp" % (db_path, os.getpid())
+    archive = assets_archive(assets_file_path, fmt)
+    db = sqlite3.connect(tmp_path)
+    done = False
+    try:
+        db.executescript(STORE_SCHEMA)
+        db.execute("INSERT INTO archive VALUES (?, ?, ?)", \
+                   (json.dumps(fmt.to_json()), \
+                    archive.data[:fmt.OFFSETS_START], \
+                    json.dumps(archive.offset_table['type_sizes'])))
+
+        for index in range(archive.count('img')):
+            if verbose:
+                print("now storing image %d..." % index)
+            img_w, img_h, meta, file_len = archive.img_header(index)
+            blob = archive.img_blob(index)
+            img_pixels = None
+            if pixels:
+                img_pixels = archive.decode_img(index)[2]
+            db.execute("INSERT INTO images VALUES " \
+                       "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", \
+                       [index, img_w, img_h] + meta + \
+                       [blob, md5_hex(blob), img_pixels])
+
+        for index in range(archive.count('sound')):
+            meta, blob = archive.sound(index)
+            db.execute("INSERT INTO sounds VALUES (?, ?, ?, ?, ?, ?, ?)", \
+                       [index] + meta + [blob, md5_hex(blob)])
+
+        for index in range(archive.count('font')):
+            blob = archive.entry('font', index)
+            db.execute("INSERT INTO fonts VALUES (?, ?, ?)", \
+                       (index, blob, md5_hex(blob)))
+
+        for index in range(archive.count('shader')):
+            vert, frag = archive.shader(index)
+            db.execute("INSERT INTO shaders VALUES (?, ?, ?, ?)", \
+                       (index, vert, frag, md5_hex(vert + frag)))
+
+        for index in range(archive.count('file')):
+            blob = archive.text_file(index)
+            db.execute("INSERT INTO files VALUES (?, ?, ?)", \
+                       (index, blob, md5_hex(blob)))
+        db.commit()
+        done = True
+    finally:
+        db.close()
+        archive.close()
+        if done:
+            os.replace(tmp_path, db_path)
+        else:
+            os.remove(tmp_path)
+
+def write_text_blob(assets_file, blob):
+    assets_file.write(struct.pack("<I", len(blob)))
+    assets_file.write(blob)
+
+def check_count(asset_class, offsets, count):
+    if len(offsets) != count:
+        raise ValueError("database has %d %s entries but the format says there should be %d" % (len(offsets), asset_class, count))
+
+def write_assets_file_from_db(assets_file_path, db_path, clear_alpha=False, \
+                              verbose=False):
+    """
+    build a new Assets.dat at assets_file_path out of the SQLite database at
+    db_path.  Every table is read with one scan in index order.  clear_alpha
+    is passed on to write_img_entry for images that have to be compressed
+    again; the others are copied exactly as they were.
+    """
+    db = sqlite3.connect(db_path)
+    try:
+        format_json, preload, type_sizes = \
+            db.execute("SELECT format, preload, type_sizes FROM archive") \
+              .fetchone()
+        fmt = assets_format(json.loads(format_json))
+        type_sizes = json.loads(type_sizes)
+
+        assets_file = open(assets_file_path, "wb")
+        assets_file.write(preload)
+        if assets_file.tell() != fmt.OFFSETS_START:
+            raise ValueError("preload_data has a length of %d (should be %d)" % \
+                             (len(preload), fmt.OFFSETS_START))
+        assets_file.seek(fmt.OFFSETS_START + fmt.offset_block_len(), \
+                         os.SEEK_SET)
+
+        img_offsets = []
+        for row in db.execute("SELECT idx, width, height, meta0, meta1, " \
+                              "meta2, meta3, blob, pixels FROM images " \
+                              "ORDER BY idx"):
+            index, img_w, img_h = row[0:3]
+            meta = list(row[3:7])
+            blob, img_pixels = row[7:9]
+            if verbose:
+                print("now saving image %d..." % index)
+            img_offsets.append(assets_file.tell())
+            if blob is None:
+                if img_pixels is None:
+                    raise ValueError("image %d has neither a blob nor pixels" % \
+                                     index)
+                write_img_entry(assets_file, fmt, img_w, img_h, meta, \
+                                img_pixels, "image %d" % index, \
+                                clear_alpha=clear_alpha, verbose=verbose)
+            else:
+                assets_file.write(IMG_HEADER.pack(img_w, img_h, meta[0], \
+                                                  meta[1], meta[2], meta[3], \
+                                                  len(blob)))
+                assets_file.write(blob)
+        check_count("image", img_offsets, fmt.IMG_COUNT)
+
+        sound_offsets = []
+        for row in db.execute("SELECT meta0, meta1, meta2, meta3, blob " \
+                              "FROM sounds ORDER BY idx"):
+            sound_offsets.append(assets_file.tell())
+            assets_file.write(struct.pack("BBBB", *row[0:4]))
+            write_text_blob(assets_file, row[4])
+        check_count("sound", sound_offsets, fmt.SOUND_COUNT)
+
+        font_offsets = []
+        for row in db.execute("SELECT blob FROM fonts ORDER BY idx"):
+            font_offsets.append(assets_file.tell())
+            assets_file.write(row[0])
+        check_count("font", font_offsets, fmt.FONT_COUNT)
+
+        shader_offsets = []
+        for row in db.execute("SELECT vert, frag FROM shaders ORDER BY idx"):
+            shader_offsets.append(assets_file.tell())
+            write_text_blob(assets_file, row[0])
+            write_text_blob(assets_file, row[1])
+        check_count("shader", shader_offsets, fmt.SHADER_COUNT)
+
+        file_offsets = []
+        for row in db.execute("SELECT blob FROM files ORDER BY idx"):
+            file_offsets.append(assets_file.tell())
+            write_text_blob(assets_file, row[0])
+        check_count("file", file_offsets, fmt.FILE_COUNT)
+
+        if verbose:
+            print("now writing metadata block...")
+        assets_file.seek(fmt.OFFSETS_START, os.SEEK_SET)
+        for offset in (img_offsets + sound_offsets + font_offsets + \
+                       shader_offsets + file_offsets + type_sizes):
+            assets_file.write(struct.pack("<I", offset))
+        assets_file.close()
+    finally:
+        db.close()
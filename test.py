@@ -17,10 +17,17 @@
 # then extract the file that was just recompressed with fp-assets.py
 # there are now two separate .png files for each image.  If there are no bugs
 #     in chowimg then the two .png files should match byte-for-byte
+# every image is also compressed with chowimg.compress_img directly and has to
+#     decode back to exactly the same pixels
+# finally the original is extracted twice more with --cache (the second time
+#     every image comes out of the cache) and those have to match too
 
 import sys
 import os
+import io
 import hashlib
+from PIL import Image
+from chowimg import compress_img, load_img
 
 def md5sum(path):
     hasher = hashlib.md5()
@@ -42,6 +49,8 @@ os.mkdir(TEST_DIR)
 first_extract_path=os.path.join(TEST_DIR, "first_extract")
 second_extract_path=os.path.join(TEST_DIR, "second_extract")
 recompress_path=os.path.join(TEST_DIR, "recompressed_assets.dat")
+cache_path=os.path.join(TEST_DIR, "cache")
+cache_extract_paths=[os.path.join(TEST_DIR, "cache_extract_%d" % run) for run in range(2)]
 
 # extract it
 os.system("./fp-assets.py -xf %s %s" % (src_dat, first_extract_path))
@@ -52,6 +61,10 @@ os.system("./fp-assets.py -cf %s %s" % (recompress_path, first_extract_path))
 # extract the new assets.dat file we just created
 os.system("./fp-assets.py -v -m %s -xf %s %s" % (os.path.join(first_extract_path, "format.json"), recompress_path, second_extract_path))
 
+# extract it with the decode cache, once to fill it and once out of it
+for cache_extract_path in cache_extract_paths:
+    os.system("./fp-assets.py --cache=%s -xf %s %s" % (cache_path, src_dat, cache_extract_path))
+
 retcode=0
 for path in os.listdir(os.path.join(first_extract_path, "images")):
     ext = path.rpartition('.')[2].casefold()
@@ -62,7 +75,19 @@ for path in os.listdir(os.path.join(first_extract_path, "images")):
     if md5sum(path1) != md5sum(path2):
         print("ERROR: md5sum of %s and %s do not match!" % (path1, path2))
         retcode+=1
+    for cache_extract_path in cache_extract_paths:
+        path3 = os.path.join(cache_extract_path, "images", path)
+        if md5sum(path1) != md5sum(path3):
+            print("ERROR: md5sum of %s and %s do not match!" % (path1, path3))
+            retcode+=1
+
+    img = Image.open(path1).convert("RGBA")
+    rawdat = img.tobytes()
+    compressed = compress_img(rawdat, quiet=True)
+    if bytes(load_img(io.BytesIO(compressed), len(compressed))) != rawdat:
+        print("ERROR: %s does not decode back to the same pixels after compress_img!" % path1)
+        retcode+=1
 
 if retcode == 0:
-    print("all images have matching checksums")
+    print("all images have matching checksums and survive compress_img")
 exit(retcode)